@@ -28,6 +28,45 @@ def sequence_int(i = 10, step = 10):
         yield i
         i += step
 
+def association_target(element):
+    """Name of the entity element refers to, None if element is no association"""
+    if 'definition' in element and 'target' in element['definition']:
+        return element['definition']['target']
+    if 'items' in element and 'definition' in element['items'] and 'target' in element['items']['definition']:
+        return element['items']['definition']['target']
+    return None
+
+def association_paths(element, path = None):
+    """(path, target entity name) of all associations reachable from element without crossing an association"""
+    if path is None:
+        path = []
+    res = []
+    target = association_target(element)
+    if target and path:
+        res.append((path, target))
+    elif 'elements' in element:
+        for k, v in element['elements'].items():
+            res.extend(association_paths(v, path + [k]))
+    elif 'items' in element:
+        res.extend(association_paths(element['items'], path))
+    return res
+
+def association_prefix(mapping, entity, path):
+    """Part of a valid path up to the last association it crosses, None if path stays within entity"""
+    prefix = None
+    pos = entity
+    for i, name in enumerate(path[:-1]):
+        while not 'elements' in pos:
+            pos = pos['items']
+        element = pos['elements'][name]
+        target = association_target(element)
+        if target:
+            prefix = tuple(path[:i + 1])
+            pos = mapping['entities'][target]
+        else:
+            pos = element
+    return prefix
+
 class ColumnView:
     """Column view definition"""
     def __init__(self, mapping, anchor_entity_name, schema_name, default_annotations) -> None:
@@ -231,6 +270,20 @@ class ColumnView:
         for path in path_list:
             self._selector_from_path(path, self.selector)
 
+    @staticmethod
+    def _selector_paths(selector, path, res):
+        if 'elements' in selector:
+            for k, v in selector['elements'].items():
+                ColumnView._selector_paths(v, path + [k], res)
+        else:
+            res.append(path)
+
+    def default_path_list(self, entity):
+        """Paths of all properties of entity contained in its default view"""
+        res = []
+        self._selector_paths(self._make_default_selector(entity, [], None), [], res)
+        return res
+
     def by_default(self):
         self.view_columns = {}
         self.selector = self._make_default_selector(self.anchor_entity, [], None)
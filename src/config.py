@@ -1,7 +1,7 @@
 '''Setup and configuration'''
 from argparse import ArgumentParser
 from db_connection_pool import Credentials, ConnectionPool, DBConnection
-from constants import DBUserType, SCHEMA_PREFIX_MAX_LENGTH, CONFIG_FILE_NAME
+from constants import DBUserType, SCHEMA_PREFIX_MAX_LENGTH, CONFIG_FILE_NAME, POOL_DEFAULTS
 from enum import Enum
 import logging
 import sys
@@ -75,6 +75,7 @@ if __name__ == '__main__':
                 config['deployment']['schemaPrefix'] = args.db_schema_prefix
                 config['deployment']['testTenant'] = generate_secure_alphanum_string()
                 config['db'] = {'connection':{'host': args.db_host, 'port': args.db_port}, 'user':{}}
+                config['db']['pool'] = dict(POOL_DEFAULTS)
                 if not (args.db_host and args.db_port and args.db_setup_user and \
                     args.db_setup_password and args.db_schema_prefix):
                     args_list = ['db-host', 'db-port', 'db-setup-user', 'db-setup-password', 'schema-prefix']
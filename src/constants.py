@@ -17,6 +17,64 @@ TYPES_SPATIAL = set(['ST_POINT', 'ST_GEOMETRY'])
 SPATIAL_DEFAULT_SRID = 4326
 CONCURRENT_CONNECTIONS = 12
 
+# key lists are bound as parameters in chunks of these sizes (last one is the maximum).
+# The last chunk is padded with NULL, so that only few distinct statements need to be prepared
+IN_LIST_CHUNK_SIZES = (10, 100, 1000)
+# above this number of source keys (name, type, sid), they are resolved by a join with a temporary table
+SOURCE_KEYS_BULK_THRESHOLD = 100
+# default number of objects per batch of the streaming ingest
+INGEST_BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 1000
+
+# connection pool defaults, can be overwritten in section db.pool of the config file
+# and per DB user in db.user.<user type>.pool. executorWorkers None means one worker per connection,
+# healthCheckInterval 0 disables the background validation of idle connections
+POOL_DEFAULTS = {
+    'minConnections': 1,
+    'maxConnections': 2 * CONCURRENT_CONNECTIONS,
+    'acquireTimeout': 30.0,
+    'idleTimeout': 300.0,
+    'executorWorkers': None,
+    'validationInterval': 30.0,
+    'maxLifetime': 3600.0,
+    'healthCheckInterval': 60.0,
+    'statementCacheSize': 64
+}
+
+# cache of tenant mappings, can be overwritten in section server.controlCache of the config file.
+# Cached tenants are revalidated against the CREATED_AT stamps in _CONTROL after ttl seconds,
+# maxBytes limits the total size of the cached mappings (length of their JSON).
+# The prefetchTenants most recently created tenants are loaded in the background at startup
+CONTROL_CACHE_DEFAULTS = {
+    'ttl': 10.0,
+    'maxTenants': 1000,
+    'maxBytes': 512 * 1024 * 1024,
+    'prefetchTenants': 20
+}
+
+# cache of the dynamic column views of search queries, can be overwritten in section
+# server.viewCache of the config file. Views not used for ttl seconds are dropped
+VIEW_CACHE_DEFAULTS = {
+    'maxViews': 1000,
+    'ttl': 600.0
+}
+
+# cache of search results, can be overwritten in section server.searchCache of the config file.
+# Results are dropped on writes to the tenant (of the same worker, the invalidation is per worker)
+# and after ttl seconds
+SEARCH_CACHE_DEFAULTS = {
+    'maxBytes': 64 * 1024 * 1024,
+    'ttl': 30.0
+}
+
+# cache of the $metadata documents, can be overwritten in section server.metadataCache of the
+# config file. Documents are cached per version of the control data, dropped on deployment or
+# deletion of the tenant and after ttl seconds
+METADATA_CACHE_DEFAULTS = {
+    'maxBytes': 16 * 1024 * 1024,
+    'ttl': 3600.0
+}
+
 CSON_TYPES = set(['cds.UUID','cds.String','cds.LargeString','cds.Varchar','cds.Integer64'\
     ,'cds.Timestamp','cds.Boolean','cds.Date','cds.Integer','cds.Decimal','cds.Double'\
     ,'cds.Time','cds.DateTime','cds.Timestamp','cds.Binary','cds.LargeBinary'\
@@ -26,6 +84,8 @@ CSON_TYPES = set(['cds.UUID','cds.String','cds.LargeString','cds.Varchar','cds.I
 ])
 
 COLUMN_ANNOTATIONS = set(['@sap.esh.isVirtual', '@sap.esh.isText'])
+# entity annotation: list of path lists, a column view is created at deploy time for each of them
+SEARCH_VIEWS_ANNOTATION = '@sap.esh.searchViews'
 
 class DBUserType(Enum):
     ADMIN = 'admin'
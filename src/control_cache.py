@@ -0,0 +1,111 @@
+"""Cache of the tenant control data (mapping and id generator) read from table _CONTROL"""
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+def parse_mapping(content: str):
+    """Parses the mapping JSON of _CONTROL"""
+    return json.loads(content)
+
+
+class ControlEntry():
+    """Control data of one tenant. version identifies the content of _CONTROL
+    (CREATED_AT per TYPE), size is the length of the mapping JSON"""
+
+    def __init__(self, version, mapping, id_generator, size: int) -> None:
+        self.version = version
+        self.mapping = mapping
+        self.id_generator = id_generator
+        self.size = size
+        self.checked_at = monotonic()
+
+
+class ControlCache():
+    """LRU cache of ControlEntry per tenant schema, limited in the number of tenants and in the
+    total size of their mappings. Entries older than ttl seconds are stale and must be
+    revalidated against the version in _CONTROL, so that deployments and deletions done
+    by other workers become visible. on_evict(schema_name) is called for every entry
+    which is removed or replaced. clock returns the current time in seconds"""
+
+    def __init__(self, ttl: float, max_tenants: int, max_bytes: int, on_evict=None, clock=monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.max_tenants = max_tenants
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def get(self, schema_name):
+        """Returns (entry, stale). entry is None if the tenant is not cached"""
+        with self.lock:
+            if not schema_name in self.entries:
+                self.misses += 1
+                return None, False
+            self.entries.move_to_end(schema_name)
+            self.hits += 1
+            entry = self.entries[schema_name]
+            return entry, self.clock() - entry.checked_at > self.ttl
+
+    def validated(self, entry: ControlEntry):
+        """entry is still up to date"""
+        with self.lock:
+            entry.checked_at = self.clock()
+            self.revalidations += 1
+
+    def put(self, schema_name, entry: ControlEntry):
+        evicted = []
+        with self.lock:
+            if schema_name in self.entries:
+                self.size -= self.entries.pop(schema_name).size
+                self.reloads += 1
+                evicted.append(schema_name)
+            entry.checked_at = self.clock()
+            self.entries[schema_name] = entry
+            self.size += entry.size
+            while len(self.entries) > 1 and\
+                (len(self.entries) > self.max_tenants or self.size > self.max_bytes):
+                evicted_name, evicted_entry = self.entries.popitem(last=False)
+                self.size -= evicted_entry.size
+                self.evictions += 1
+                evicted.append(evicted_name)
+        if self.on_evict:
+            for w in evicted:
+                self.on_evict(w)
+
+    def grow(self, entry: ControlEntry, size: int):
+        """Adds size to a cached entry, e.g. for lazily loaded parts of its mapping"""
+        with self.lock:
+            entry.size += size
+            if any(w is entry for w in self.entries.values()):
+                self.size += size
+
+    def pop(self, schema_name):
+        with self.lock:
+            entry = self.entries.pop(schema_name, None)
+            if entry:
+                self.size -= entry.size
+        if self.on_evict:
+            self.on_evict(schema_name)
+
+    def metrics(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'tenants': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / requests if requests else 0.0,
+                'revalidations': self.revalidations,
+                'reloads': self.reloads,
+                'evictions': self.evictions
+            }
@@ -2,8 +2,8 @@
 from uuid import uuid1
 from name_mapping import NameMapping
 import json
-import base64
-from constants import TYPES_B64_DECODE, TYPES_SPATIAL, SPATIAL_DEFAULT_SRID, ENTITY_PREFIX, COLUMN_ANNOTATIONS
+from constants import TYPES_SPATIAL, SPATIAL_DEFAULT_SRID, ENTITY_PREFIX, COLUMN_ANNOTATIONS
+from mapping_model import MappingModel
 from copy import deepcopy
 from enum import Enum
 
@@ -500,18 +500,11 @@ def get_parents(tables, table, steps):
     else:
         return get_parents(tables, tables[parent], steps - 1) + [parent]
 
-def value_ext_to_int(typ, value):
-    if typ in TYPES_B64_DECODE:
-        return base64.decodebytes(value.encode('utf-8'))
-    elif typ in TYPES_SPATIAL:
-        return json.dumps(value)
-    return value
-
-
-def array_to_dml(idmapping, mapping, inserts, objects, subtable_level, parent_object_id, id_generator, entity, k):
+def array_to_dml(idmapping, model, inserts, objects, subtable_level, parent_object_id, id_generator, entity, k):
     is_association = 'definition' in entity and 'type' in entity['definition']\
         and entity['definition']['type'] == 'cds.Association'
     full_table_name = entity['table_name']
+    value_column = model.table(full_table_name).column('_VALUE')
     if not full_table_name in inserts:
         _, _, key_columns = get_key_columns(subtable_level, id_generator)
         key_col_names = {k:idx for idx, k in enumerate(key_columns.keys())}
@@ -526,8 +519,7 @@ def array_to_dml(idmapping, mapping, inserts, objects, subtable_level, parent_ob
             value = association_to_dml(id_generator, idmapping, entity, k, obj)
         else:
             value = obj
-        row.append(value_ext_to_int(\
-            mapping['tables'][full_table_name]['columns']['_VALUE']['type'], value))
+        row.append(value_column.ext_to_int(value))
         inserts[full_table_name]['rows'].append(row)
 
 
@@ -556,7 +548,7 @@ def association_to_dml(id_generator, idmapping, prop, k, v):
         raise DataException(f'Association property {k} has no source property')
     return value
 
-def object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator, subtable_level = 0, col_prefix = [],\
+def object_to_dml(model, inserts, objects, idmapping, write_mode, id_generator, subtable_level = 0, col_prefix = [],\
     parent_object_id = None, propagated_row = None, propagated_object_id = None
     , entity = {}, parent_table_name = '', external_id = False):
     if 'table_name' in entity:
@@ -565,6 +557,7 @@ def object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator
         full_table_name = parent_table_name
     if 'items' in entity:
         raise DataException(f'list expected for {json.dumps(objects)}')
+    table = model.table(full_table_name)
     for obj in objects:
         if write_mode == WriteMode.CREATE and subtable_level == 0 and 'id' in obj and not external_id:
             raise DataException('id is a reserved property name')
@@ -590,7 +583,7 @@ def object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator
                                 else:
                                     object_id = id_generator.get_id(full_table_name, subtable_level)
                                 idmapping[hashable_key] = {'id':object_id, 'resolved':True}
-                    if mapping['tables'][full_table_name]['pk'] == 'ID':
+                    if table.pk == 'ID':
                         if not object_id:
                             if external_id:
                                 object_id = obj['id']
@@ -598,8 +591,7 @@ def object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator
                                 object_id = id_generator.get_id(full_table_name, subtable_level)
                         obj['id'] = object_id
                 else:
-                    key = mapping['tables'][full_table_name]['columns'][mapping['tables'][full_table_name]['pk']]['external_path'][0]
-                    object_id = obj[key]
+                    object_id = obj[table.column(table.pk).external_path[0]]
             else:
                 object_id = id_generator.get_id(full_table_name, subtable_level)
                 row.append(object_id)
@@ -627,22 +619,21 @@ def object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator
                 if not 'items' in entity['elements'][k]:
                     raise DataException(f'{k} is not an array property')
                 if entity['elements'][k]['items']['elements']:
-                    object_to_dml(mapping, inserts, v, idmapping, write_mode, id_generator,\
+                    object_to_dml(model, inserts, v, idmapping, write_mode, id_generator,\
                         subtable_level + 1, parent_object_id = object_id,
                         entity=entity['elements'][k]['items'], parent_table_name=full_table_name)
                 else:
-                    array_to_dml(idmapping, mapping, inserts, v, subtable_level + 1, object_id, id_generator
+                    array_to_dml(idmapping, model, inserts, v, subtable_level + 1, object_id, id_generator
                     , entity['elements'][k]['items'], k)
             elif value is None and isinstance(v, dict) and (not 'column_name' in entity['elements'][k] or not \
-                mapping['tables'][full_table_name]['columns'][entity['elements'][k]['column_name']]['type'] in TYPES_SPATIAL):
-                object_to_dml(mapping, inserts, [v], idmapping, write_mode, id_generator, subtable_level,\
+                table.column(entity['elements'][k]['column_name']).is_spatial):
+                object_to_dml(model, inserts, [v], idmapping, write_mode, id_generator, subtable_level,\
                      col_prefix + [k], propagated_row = row, propagated_object_id=object_id, 
                     entity=entity['elements'][k], parent_table_name=full_table_name)
             else:
                 column_name = entity['elements'][k]['column_name']
                 if not value:
-                    value = value_ext_to_int(\
-                        mapping['tables'][full_table_name]['columns'][column_name]['type'], v)
+                    value = table.column(column_name).ext_to_int(v)
                 if not column_name in inserts[full_table_name]['columns']:
                     inserts[full_table_name]['columns'][column_name] = len(inserts[full_table_name]['columns'])
                     row.append(value)
@@ -652,13 +643,16 @@ def object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator
             inserts[full_table_name]['rows'].append(row)
 
 
-def objects_to_dml(mapping, objects, write_mode, id_generator, external_id = False):
+def objects_to_dml(mapping, objects, write_mode, id_generator, external_id = False, model = None):
+    """model: compiled MappingModel of mapping, created for this call if not given"""
+    if model is None:
+        model = MappingModel(mapping)
     inserts = {}
     idmapping = {}
     for object_type, objects in objects.items():
         if not object_type in mapping['entities']:
             raise DataException(f'Unknown object type {object_type}')
-        object_to_dml(mapping, inserts, objects, idmapping, write_mode, id_generator,
+        object_to_dml(model, inserts, objects, idmapping, write_mode, id_generator,
             entity=mapping['entities'][object_type], external_id = external_id)
     if idmapping:
         dangling = [json.loads(k) for k, v in idmapping.items() if not v['resolved']]
@@ -0,0 +1,129 @@
+"""Difference between the rows of objects on the DB and their new version.
+Used for updates which only touch changed columns and changed subtable rows"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+
+from constants import TYPES_SPATIAL
+from mapping_model import MappingModel
+
+
+def comparable(typ, value):
+    """Normalizes value of column type typ, so that values read from the DB and
+    values converted from the external format can be compared. Values which cannot be
+    normalized are returned unchanged (and are then rewritten if they differ)"""
+    if value is None:
+        return None
+    if hasattr(value, 'read'):
+        value = value.read()
+    try:
+        if typ in TYPES_SPATIAL:
+            return json.dumps(json.loads(value) if isinstance(value, str) else value, sort_keys=True)
+        match typ:
+            case 'DATE':
+                return date.fromisoformat(value) if isinstance(value, str) else value
+            case 'TIME':
+                return time.fromisoformat(value) if isinstance(value, str) else value
+            case 'TIMESTAMP' | 'SECONDDATE':
+                return datetime.fromisoformat(value) if isinstance(value, str) else value
+            case 'DECIMAL' | 'SMALLDECIMAL':
+                return Decimal(str(value))
+            case 'DOUBLE' | 'REAL':
+                return float(value)
+            case 'INTEGER' | 'BIGINT' | 'SMALLINT' | 'TINYINT':
+                return int(value)
+            case 'BOOLEAN':
+                return bool(value)
+    except (ValueError, TypeError, InvalidOperation):
+        pass
+    return value
+
+
+class ObjectDiff():
+    """Compares old and new rows of the objects of one root table.
+    Rows are dicts column name -> value. Subtable rows have no external identity, so
+    they are matched by content: a subtable row (including all its subtable rows) which exists
+    unchanged in old and new version is kept, all other old rows are deleted and new rows inserted"""
+
+    def __init__(self, mapping, root_table_name, model: MappingModel = None):
+        self.model = model if model is not None else MappingModel(mapping)
+        self.root_table = self.model.table(root_table_name)
+        self.updates = {}
+        self.deletes = {}
+        self.inserts = {}
+
+    def _group_by_parent(self, rows):
+        res = {}
+        for table_name, table_rows in rows.items():
+            table = self.model.table(table_name)
+            if table.level == 0:
+                continue
+            by_parent = {}
+            for row in table_rows:
+                parent_id = row[table.pk_parent]
+                if not parent_id in by_parent:
+                    by_parent[parent_id] = []
+                by_parent[parent_id].append(row)
+            res[table_name] = by_parent
+        return res
+
+    def _signature(self, table_name, row, by_parent):
+        table = self.model.table(table_name)
+        values = tuple(comparable(w.type, row.get(w.name)) for w in table.data)
+        children = []
+        for child_table_name in table.children:
+            child_rows = by_parent[child_table_name].get(row[table.pk], [])\
+                if child_table_name in by_parent else []
+            children.append(tuple(sorted(\
+                [self._signature(child_table_name, w, by_parent) for w in child_rows], key=repr)))
+        return (values, tuple(children))
+
+    def _add(self, target, table_name, row, by_parent, only_key):
+        table = self.model.table(table_name)
+        if not table_name in target:
+            target[table_name] = []
+        target[table_name].append(row[table.pk] if only_key else row)
+        for child_table_name in table.children:
+            if child_table_name in by_parent:
+                for child_row in by_parent[child_table_name].get(row[table.pk], []):
+                    self._add(target, child_table_name, child_row, by_parent, only_key)
+
+    def compare(self, old_rows, new_rows):
+        """old_rows, new_rows: dict table name -> list of rows of the root table and all its subtables.
+        Fills updates (root table name -> list of (changed columns, new row)),
+        deletes (table name -> list of primary keys) and inserts (table name -> list of new rows)"""
+        root_table_name = self.root_table.name
+        pk = self.root_table.pk
+        old_by_parent = self._group_by_parent(old_rows)
+        new_by_parent = self._group_by_parent(new_rows)
+        old_roots = {w[pk]: w for w in old_rows.get(root_table_name, [])}
+        for new_root in new_rows.get(root_table_name, []):
+            if not new_root[pk] in old_roots:
+                self._add(self.inserts, root_table_name, new_root, new_by_parent, False)
+                continue
+            old_root = old_roots[new_root[pk]]
+            changed = tuple(w.name for w in self.root_table.data\
+                if comparable(w.type, new_root.get(w.name)) != comparable(w.type, old_root.get(w.name)))
+            if changed:
+                if not root_table_name in self.updates:
+                    self.updates[root_table_name] = []
+                self.updates[root_table_name].append((changed, new_root))
+            for child_table_name in self.root_table.children:
+                old_children = {}
+                if child_table_name in old_by_parent:
+                    for row in old_by_parent[child_table_name].get(new_root[pk], []):
+                        signature = self._signature(child_table_name, row, old_by_parent)
+                        if signature not in old_children:
+                            old_children[signature] = []
+                        old_children[signature].append(row)
+                new_children = new_by_parent[child_table_name].get(new_root[pk], [])\
+                    if child_table_name in new_by_parent else []
+                for row in new_children:
+                    signature = self._signature(child_table_name, row, new_by_parent)
+                    if signature in old_children and old_children[signature]:
+                        old_children[signature].pop()
+                    else:
+                        self._add(self.inserts, child_table_name, row, new_by_parent, False)
+                for rows in old_children.values():
+                    for row in rows:
+                        self._add(self.deletes, child_table_name, row, old_by_parent, True)
@@ -1,13 +1,21 @@
 """DB Connection Pool for SAP HANA via hdbcli
 Usage:
 credentials = Credentials(host, port, user, password)
-db_con_pool_ddl = ConnectionPool(credentials)
+db_con_pool_ddl = ConnectionPool(credentials, min_connections=1, max_connections=24)
 with DBConnection(db_con_pool_ddl) as db:
     db.cur.execute('select * from dummy')
+
+Usage in coroutines (DB calls are executed in the executor of the pool):
+async with AsyncDBConnection(db_con_pool_ddl) as db:
+    rows = await db.cur.execute_fetchall('select * from dummy')
 """
-from asyncio import gather, get_event_loop
+from asyncio import CancelledError, gather, get_running_loop, wrap_future
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import List, Tuple
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+from typing import Callable, List, Tuple
 
 from hdbcli import dbapi
 
@@ -20,46 +28,142 @@ class Credentials():
         self.password = password
 
 
-async def execute_async(self, operation):
-    loop = get_event_loop()
-    return await loop.run_in_executor(None, partial(self.execute, operation))
-dbapi.Cursor.execute_async = execute_async
-
-
 def execute_fetchall(self, operation):
     self.execute(operation)
     return self.fetchall()
 dbapi.Cursor.execute_fetchall = execute_fetchall
 
 
-async def execute_fetchall_async(self, operation):
-    loop = get_event_loop()
-    return await loop.run_in_executor(None, partial(self.execute_fetchall, operation))
-dbapi.Cursor.execute_fetchall_async = execute_fetchall_async
-
-
-async def executemany_async(self, operation):
-    loop = get_event_loop()
-    return await loop.run_in_executor(None, partial(self.executemany, operation[0], operation[1]))
-dbapi.Cursor.executemany_async = executemany_async
-
-
-async def commit_async(self):
-    loop = get_event_loop()
-    return await loop.run_in_executor(None, self.commit)
-dbapi.Connection.commit_async = commit_async
-
-
-async def rollback_async(self):
-    loop = get_event_loop()
-    return await loop.run_in_executor(None, self.rollback)
-dbapi.Connection.rollback_async = rollback_async
+# hdbcli error codes which indicate that the connection to the DB is lost
+CONNECTION_ERROR_CODES = set([-10709, -10807, -10108, -10821])
+
+
+def is_connection_error(e: dbapi.Error) -> bool:
+    return getattr(e, 'errorcode', None) in CONNECTION_ERROR_CODES
+
+
+def retry_read(func):
+    """Runs func(validate). If the DB connection turns out to be lost, func is run once more
+    with validate=True, i.e. on a validated connection. Only for idempotent reads"""
+    try:
+        return func(False)
+    except dbapi.Error as e:
+        if not is_connection_error(e):
+            raise
+    return func(True)
+
+
+async def retry_read_async(func):
+    """Coroutine version of retry_read"""
+    try:
+        return await func(False)
+    except dbapi.Error as e:
+        if not is_connection_error(e):
+            raise
+    return await func(True)
+
+
+class DBExecutor(ThreadPoolExecutor):
+    """Thread pool executor for DB calls. Records queue depth and the time
+    calls wait in the queue until a worker thread picks them up"""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = ''):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._metrics_lock = Lock()
+        self.num_queued = 0
+        self.max_queued = 0
+        self.num_calls = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted_at = monotonic()
+        with self._metrics_lock:
+            self.num_queued += 1
+            self.max_queued = max(self.max_queued, self.num_queued)
+
+        def run():
+            wait_time = monotonic() - submitted_at
+            with self._metrics_lock:
+                self.num_queued -= 1
+                self.num_calls += 1
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+            return fn(*args, **kwargs)
+        return super().submit(run)
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                'workers': self._max_workers,
+                'queueDepth': self.num_queued,
+                'queueDepthMax': self.max_queued,
+                'calls': self.num_calls,
+                'waitTimeAvg': self.wait_time_total / self.num_calls if self.num_calls else 0.0,
+                'waitTimeMax': self.wait_time_max}
+
+
+class StatementCacheMetrics():
+    """Hit and miss counters shared by the statement caches of one pool"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def metrics(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hitRate': self.hits / total if total else 0.0}
+
+
+class StatementCache():
+    """LRU cache of prepared statements of one connection, keyed by SQL text.
+    Each statement is prepared on a cursor of its own, which is reused on a hit"""
+
+    def __init__(self, con, max_size: int, metrics: StatementCacheMetrics = None):
+        self.con = con
+        self.max_size = max_size
+        self.metrics = metrics if metrics else StatementCacheMetrics()
+        self.statements = OrderedDict()
+
+    def get(self, operation: str):
+        cursor = self.statements.get(operation)
+        if cursor is not None:
+            self.statements.move_to_end(operation)
+            self.metrics.hit()
+            return cursor
+        self.metrics.miss()
+        cursor = self.con.cursor()
+        cursor.prepare(operation)
+        if self.max_size > 0:
+            self.statements[operation] = cursor
+            if len(self.statements) > self.max_size:
+                _, evicted = self.statements.popitem(last=False)
+                evicted.close()
+        return cursor
+
+    def clear(self):
+        for cursor in self.statements.values():
+            cursor.close()
+        self.statements.clear()
 
 
 class SharedConnection():
-    """Represents the actual connection to the DB"""
+    """Represents the actual connection to the DB.
+    The ..._async methods run the DB call in the given executor"""
 
-    def __init__(self, credentials: Credentials):
+    def __init__(self, credentials: Credentials, executor: ThreadPoolExecutor = None,
+                 statement_cache_size: int = 64, statement_cache_metrics: StatementCacheMetrics = None):
+        self.executor = executor
         self.con = dbapi.connect(
             address=credentials.host,
             port=credentials.port,
@@ -68,69 +172,456 @@ class SharedConnection():
             autocommit=False
         )
         self.cur = self.con.cursor()
+        # local temporary tables created in the session of this connection
+        self.session_tables = set()
+        self.statements = StatementCache(self.con, statement_cache_size, statement_cache_metrics)
+        self.created_at = monotonic()
+        self.validated_at = self.created_at
+        self.idle_since = self.created_at
+
+    def is_alive(self, validation_interval: float = 0.0) -> bool:
+        """isconnected() is checked always. The roundtrip to the DB is done only if the
+        last successful validation is older than validation_interval seconds"""
+        try:
+            if not self.con.isconnected():
+                return False
+            now = monotonic()
+            if now - self.validated_at >= validation_interval:
+                self.cur.execute('select 1 from dummy')
+                self.cur.fetchall()
+                self.validated_at = now
+            return True
+        except dbapi.Error:
+            return False
 
     def __enter__(self):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        self.cur.close()
-        self.con.close()
+        self.close()
 
     def refresh_cursor(self):
         self.cur.close()
         self.cur = self.con.cursor()
 
+    def close(self):
+        self.statements.clear()
+        self.cur.close()
+        self.con.close()
 
-class ConnectionPool():
-    """Connection Pool"""
+    def execute_prepared(self, operation: str, parameters=()):
+        """Executes operation as prepared statement from the statement cache.
+        Returns the cursor of the prepared statement for fetching"""
+        cursor = self.statements.get(operation)
+        cursor.executeprepared(parameters)
+        return cursor
+
+    def execute_prepared_fetchall(self, operation: str, parameters=()):
+        return self.execute_prepared(operation, parameters).fetchall()
+
+    def executemany_prepared(self, operation: str, parameters):
+        return self.statements.get(operation).executemanyprepared(parameters)
+
+    def run_async(self, func, *args):
+        return get_running_loop().run_in_executor(self.executor, partial(func, *args))
+
+    async def execute_async(self, operation):
+        return await self.run_async(self.cur.execute, operation)
+
+    async def execute_fetchall_async(self, operation):
+        return await self.run_async(self.cur.execute_fetchall, operation)
+
+    async def executemany_async(self, operation):
+        return await self.run_async(self.executemany_prepared, operation[0], operation[1])
 
-    def __init__(self, credentials, min_connections: int = 1) -> None:
+    async def execute_prepared_async(self, operation, parameters=()):
+        return await self.run_async(self.execute_prepared, operation, parameters)
+
+    async def execute_prepared_fetchall_async(self, operation, parameters=()):
+        return await self.run_async(self.execute_prepared_fetchall, operation, parameters)
+
+    async def commit_async(self):
+        return await self.run_async(self.con.commit)
+
+    async def rollback_async(self):
+        return await self.run_async(self.con.rollback)
+
+
+class PoolTimeoutException(Exception):
+    """No connection became available within the acquire timeout"""
+
+
+class ConnectionPool():
+    """Bounded, thread-safe connection pool.
+    At most max_connections connections are open at the same time. Callers which cannot
+    be served immediately wait in FIFO order for at most acquire_timeout seconds.
+    Connections which are idle for longer than idle_timeout seconds are closed
+    until min_connections remain.
+    Connections are validated on borrow (see SharedConnection.is_alive) and replaced
+    if they are dead or older than max_lifetime seconds. If health_check_interval is set,
+    a background thread validates idle connections periodically.
+    on_connect(connection) is called for every new connection, e.g. to create session objects"""
+
+    def __init__(self, credentials, min_connections: int = 1, max_connections: int = 24,
+                 acquire_timeout: float = 30.0, idle_timeout: float = 300.0, executor_workers: int = None,
+                 validation_interval: float = 30.0, max_lifetime: float = 3600.0,
+                 health_check_interval: float = 0.0, statement_cache_size: int = 64,
+                 on_connect: Callable[['SharedConnection'], None] = None) -> None:
+        if max_connections < 1 or min_connections > max_connections:
+            raise ValueError('0 < min_connections <= max_connections required')
         self.credentials = credentials
         self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+        self.validation_interval = validation_interval
+        self.max_lifetime = max_lifetime
+        self.num_replaced = 0
+        self.statement_cache_size = statement_cache_size
+        self.statement_cache_metrics = StatementCacheMetrics()
+        self.on_connect = on_connect
+        self._lock = Condition()
+        self._waiters = deque()
+        # by default one worker per connection, because a connection is used by one statement at a time.
+        # Waiting for a free connection uses separate workers, so that waiting callers cannot block
+        # the statements of the callers which currently hold the connections.
+        self.executor = DBExecutor(executor_workers or max_connections, 'db')
+        self.checkout_executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='db_checkout')
+        self.num_acquired = 0
+        self.num_timeouts = 0
+        self.max_waiting = 0
+        self.acquire_wait_time_total = 0.0
+        self.acquire_wait_time_max = 0.0
         self.idle_connections = []
         for _ in range(min_connections):
-            self.idle_connections.append(SharedConnection(self.credentials))
+            self.idle_connections.append(self._new_connection())
+        self.num_open_connections = min_connections
         self.num_used_connections = 0
+        self._closed = Event()
+        if health_check_interval > 0:
+            Thread(target=self._health_check, args=(health_check_interval,),
+                   name='db_health_check', daemon=True).start()
+
+    def _can_serve(self, ticket, num: int) -> bool:
+        free = len(self.idle_connections) + self.max_connections - self.num_open_connections
+        return self._waiters[0] is ticket and free >= num
+
+    def _take_expired(self):
+        '''removes idle connections exceeding idle_timeout (oldest first). Caller holds the lock'''
+        expired = []
+        limit = monotonic() - self.idle_timeout
+        while self.idle_connections and self.num_open_connections > self.min_connections\
+            and self.idle_connections[0].idle_since < limit:
+            expired.append(self.idle_connections.pop(0))
+            self.num_open_connections -= 1
+        return expired
+
+    def _new_connection(self) -> SharedConnection:
+        connection = SharedConnection(self.credentials, self.executor,
+                                      self.statement_cache_size, self.statement_cache_metrics)
+        if self.on_connect:
+            try:
+                self.on_connect(connection)
+            except dbapi.Error:
+                ConnectionPool._close([connection])
+                raise
+        return connection
+
+    def _is_outdated(self, connection: SharedConnection) -> bool:
+        return monotonic() - connection.created_at > self.max_lifetime
+
+    def _validated(self, connection: SharedConnection, force_validation: bool) -> SharedConnection:
+        validation_interval = 0.0 if force_validation else self.validation_interval
+        if not self._is_outdated(connection) and connection.is_alive(validation_interval):
+            return connection
+        ConnectionPool._close([connection])
+        with self._lock:
+            self.num_replaced += 1
+        return self._new_connection()
 
-    def get_connection(self):
-        self.num_used_connections += 1
-        if len(self.idle_connections) == 0:
-            return SharedConnection(self.credentials)
-        else:
-            return self.idle_connections.pop()
+    @staticmethod
+    def _close(connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except dbapi.Error:
+                pass
+
+    def _health_check(self, interval: float):
+        while not self._closed.wait(interval):
+            with self._lock:
+                limit = monotonic() - self.validation_interval
+                checked = [w for w in self.idle_connections if w.validated_at < limit]
+                for connection in checked:
+                    self.idle_connections.remove(connection)
+                self.num_used_connections += len(checked)
+            alive = []
+            for connection in checked:
+                if not self._is_outdated(connection) and connection.is_alive():
+                    alive.append(connection)
+                else:
+                    ConnectionPool._close([connection])
+                    with self._lock:
+                        self.num_replaced += 1
+                        self.num_open_connections -= 1
+                        self.num_used_connections -= 1
+                        self._lock.notify_all()
+            with self._lock:
+                self.num_used_connections -= len(alive)
+                self.idle_connections = sorted(self.idle_connections + alive, key=lambda w: w.idle_since)
+                expired = self._take_expired()
+                self._lock.notify_all()
+            ConnectionPool._close(expired)
+            with self._lock:
+                num_missing = max(self.min_connections - self.num_open_connections, 0)
+                self.num_open_connections += num_missing
+            for _ in range(num_missing):
+                try:
+                    connection = self._new_connection()
+                except dbapi.Error:
+                    with self._lock:
+                        self.num_open_connections -= 1
+                        self._lock.notify_all()
+                    continue
+                with self._lock:
+                    self.idle_connections.insert(0, connection)
+                    self._lock.notify_all()
+
+    def close(self):
+        """Stops the health check and closes all idle connections"""
+        self._closed.set()
+        with self._lock:
+            idle_connections = self.idle_connections
+            self.idle_connections = []
+            self.num_open_connections -= len(idle_connections)
+        ConnectionPool._close(idle_connections)
+
+    def get_connections(self, num: int, timeout: float = None, validate: bool = False) -> List[SharedConnection]:
+        """Acquires num connections at once. All or nothing, so that concurrent bulk
+        operations cannot deadlock by each holding a part of the pool.
+        validate=True forces a DB roundtrip to validate idle connections"""
+        if num > self.max_connections:
+            raise ValueError(f'cannot acquire {num} connections from pool with max_connections {self.max_connections}')
+        if timeout is None:
+            timeout = self.acquire_timeout
+        requested_at = monotonic()
+        deadline = requested_at + timeout
+        with self._lock:
+            ticket = object()
+            self._waiters.append(ticket)
+            self.max_waiting = max(self.max_waiting, len(self._waiters))
+            try:
+                while not self._can_serve(ticket, num):
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.num_timeouts += 1
+                        raise PoolTimeoutException(
+                            f'no DB connection available within {timeout} seconds '
+                            f'({self.num_used_connections} of {self.max_connections} in use)')
+                    self._lock.wait(remaining)
+            finally:
+                self._waiters.remove(ticket)
+                self._lock.notify_all()
+            wait_time = monotonic() - requested_at
+            self.num_acquired += 1
+            self.acquire_wait_time_total += wait_time
+            self.acquire_wait_time_max = max(self.acquire_wait_time_max, wait_time)
+            self.num_used_connections += num
+            taken = [self.idle_connections.pop() for _ in range(min(num, len(self.idle_connections)))]
+            num_new = num - len(taken)
+            self.num_open_connections += num_new
+        connections = []
+        try:
+            while taken:
+                connections.append(self._validated(taken.pop(), validate))
+            for _ in range(num_new):
+                connections.append(self._new_connection())
+        except dbapi.Error:
+            connections.extend(taken)
+            num_missing = num - len(connections)
+            with self._lock:
+                self.num_open_connections -= num_missing
+                self.num_used_connections -= num_missing
+                self._lock.notify_all()
+            self.return_connections(connections)
+            raise
+        return connections
+
+    def get_connection(self, timeout: float = None, validate: bool = False) -> SharedConnection:
+        return self.get_connections(1, timeout, validate)[0]
+
+    def return_connections(self, connections: List[SharedConnection]):
+        broken = []
+        for connection in connections:
+            if self._is_outdated(connection):
+                broken.append(connection)
+                continue
+            try:
+                # the next borrower must not commit what the previous one left uncommitted
+                connection.con.rollback()
+                connection.refresh_cursor()
+            except dbapi.Error:
+                broken.append(connection)
+        now = monotonic()
+        with self._lock:
+            for connection in connections:
+                if connection in broken:
+                    self.num_open_connections -= 1
+                else:
+                    connection.idle_since = now
+                    self.idle_connections.append(connection)
+            self.num_used_connections -= len(connections)
+            expired = self._take_expired()
+            self._lock.notify_all()
+        ConnectionPool._close(broken + expired)
 
     def return_connection(self, connection: SharedConnection):
-        connection.refresh_cursor()
-        self.idle_connections.append(connection)
-        self.num_used_connections -= 1
+        self.return_connections([connection])
+
+    def metrics(self):
+        with self._lock:
+            res = {
+                'minConnections': self.min_connections,
+                'maxConnections': self.max_connections,
+                'openConnections': self.num_open_connections,
+                'usedConnections': self.num_used_connections,
+                'waiting': len(self._waiters),
+                'waitingMax': self.max_waiting,
+                'acquired': self.num_acquired,
+                'timeouts': self.num_timeouts,
+                'replaced': self.num_replaced,
+                'waitTimeAvg': self.acquire_wait_time_total / self.num_acquired if self.num_acquired else 0.0,
+                'waitTimeMax': self.acquire_wait_time_max}
+        res['executor'] = self.executor.metrics()
+        res['statementCache'] = self.statement_cache_metrics.metrics()
+        return res
 
 
 class DBConnection():
     """DB connection reference"""
 
-    def __init__(self, pool: ConnectionPool):
+    def __init__(self, pool: ConnectionPool, validate: bool = False):
         self.pool = pool
+        self.validate = validate
 
     def __enter__(self):
-        self.connection = self.pool.get_connection()
+        self.connection = self.pool.get_connection(validate=self.validate)
         return self.connection
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.pool.return_connection(self.connection)
 
 
+class AsyncCursor():
+    """Cursor whose DB calls are executed in the executor of the connection pool"""
+
+    def __init__(self, connection: 'AsyncSharedConnection'):
+        self.connection = connection
+
+    @property
+    def description(self):
+        return self.connection.shared_connection.cur.description
+
+    async def execute(self, operation, parameters=None):
+        if parameters is None:
+            return await self.connection.run(self.connection.shared_connection.cur.execute, operation)
+        return await self.connection.run(self.connection.shared_connection.cur.execute, operation, parameters)
+
+    async def executemany(self, operation, parameters):
+        return await self.connection.run(self.connection.shared_connection.cur.executemany, operation, parameters)
+
+    async def callproc(self, procname, parameters):
+        return await self.connection.run(self.connection.shared_connection.cur.callproc, procname, parameters)
+
+    async def fetchone(self):
+        return await self.connection.run(self.connection.shared_connection.cur.fetchone)
+
+    async def fetchmany(self, size):
+        return await self.connection.run(self.connection.shared_connection.cur.fetchmany, size)
+
+    async def fetchall(self):
+        return await self.connection.run(self.connection.shared_connection.cur.fetchall)
+
+    async def execute_fetchall(self, operation):
+        return await self.connection.run(self.connection.shared_connection.cur.execute_fetchall, operation)
+
+    async def execute_prepared_fetchall(self, operation, parameters=()):
+        return await self.connection.run(self.connection.shared_connection.execute_prepared_fetchall,
+                                         operation, parameters)
+
+
+class AsyncSharedConnection():
+    """Asynchronous access to a pooled connection"""
+
+    def __init__(self, shared_connection: SharedConnection):
+        self.shared_connection = shared_connection
+        self.cur = AsyncCursor(self)
+
+    def run(self, func, *args):
+        return self.shared_connection.run_async(func, *args)
+
+    async def commit(self):
+        return await self.run(self.shared_connection.con.commit)
+
+    async def rollback(self):
+        return await self.run(self.shared_connection.con.rollback)
+
+
+class AsyncDBConnection():
+    """Asynchronous DB connection reference. Checkout, statements and
+    return to the pool do not block the event loop"""
+
+    def __init__(self, pool: ConnectionPool, validate: bool = False):
+        self.pool = pool
+        self.validate = validate
+
+    async def __aenter__(self):
+        checkout = self.pool.checkout_executor.submit(self.pool.get_connection, None, self.validate)
+        try:
+            self.connection = await wrap_future(checkout)
+        except CancelledError:
+            # the checkout is still running in the executor and its connection must not get lost
+            checkout.add_done_callback(self._return_orphan)
+            raise
+        return AsyncSharedConnection(self.connection)
+
+    def _return_orphan(self, checkout):
+        if not checkout.cancelled() and checkout.exception() is None:
+            self.pool.return_connection(checkout.result())
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        loop = get_running_loop()
+        await loop.run_in_executor(self.pool.executor, self.pool.return_connection, self.connection)
+
+
 class DBBulkProcessing():
     """Asynchronous bulk processing of DB statements"""
 
-    def __init__(self, connection_pool: ConnectionPool, block_size: int) -> None:
+    def __init__(self, connection_pool: ConnectionPool, block_size: int, validate: bool = False) -> None:
         self.connection_pool = connection_pool
-        self.block_size = block_size
-        self.connections = [connection_pool.get_connection()
-                            for w in range(block_size)]
+        self.block_size = min(block_size, connection_pool.max_connections)
+        self.validate = validate
+        self.connections = []
 
     def __enter__(self):
+        self.connections = self.connection_pool.get_connections(self.block_size, validate=self.validate)
+        return self
+
+    async def __aenter__(self):
+        checkout = self.connection_pool.checkout_executor.submit(
+            partial(self.connection_pool.get_connections, self.block_size, validate=self.validate))
+        try:
+            self.connections = await wrap_future(checkout)
+        except CancelledError:
+            # the checkout is still running in the executor and its connections must not get lost
+            checkout.add_done_callback(self._return_orphans)
+            raise
         return self
 
+    def _return_orphans(self, checkout):
+        if not checkout.cancelled() and checkout.exception() is None:
+            self.connection_pool.return_connections(checkout.result())
+
     @staticmethod
     def blockify(operations, block_size: int):
         start = 0
@@ -143,42 +634,80 @@ class DBBulkProcessing():
     async def execute(self, operations: List[str]):
         if self.block_size == 1:
             for operation in operations:
-                self.connections[0].cur.execute(operation)
+                await self.connections[0].execute_async(operation)
         else:
             for block in DBBulkProcessing.blockify(operations, self.block_size):
-                await gather(*[self.connections[i].cur.execute_async(sql) for i, sql in enumerate(block)])
+                await gather(*[self.connections[i].execute_async(sql) for i, sql in enumerate(block)])
 
     async def execute_fetchall(self, operations: List[str]):
         res = []
         if self.block_size == 1:
             for operation in operations:
-                res.append(self.connections[0].cur.execute_fetchall(operation))
+                res.append(await self.connections[0].execute_fetchall_async(operation))
         else:
             for block in DBBulkProcessing.blockify(operations, self.block_size):
-                res.extend(await gather(*[self.connections[i].cur.execute_fetchall_async(sql) for i, sql in enumerate(block)]))
+                res.extend(await gather(*[self.connections[i].execute_fetchall_async(sql)\
+                    for i, sql in enumerate(block)]))
+        return res
+
+    async def execute_prepared(self, operations: List[Tuple[str, list]]):
+        if self.block_size == 1:
+            for operation in operations:
+                await self.connections[0].execute_prepared_async(operation[0], operation[1])
+        else:
+            for block in DBBulkProcessing.blockify(operations, self.block_size):
+                await gather(*[self.connections[i].execute_prepared_async(operation[0], operation[1])\
+                    for i, operation in enumerate(block)])
+
+    async def execute_prepared_fetchall(self, operations: List[Tuple[str, list]]):
+        res = []
+        if self.block_size == 1:
+            for operation in operations:
+                res.append(await self.connections[0].execute_prepared_fetchall_async(operation[0], operation[1]))
+        else:
+            for block in DBBulkProcessing.blockify(operations, self.block_size):
+                res.extend(await gather(*[\
+                    self.connections[i].execute_prepared_fetchall_async(operation[0], operation[1])\
+                    for i, operation in enumerate(block)]))
+        return res
+
+    async def run(self, functions: List[Callable[[SharedConnection], object]]):
+        """Calls each function with a connection of its own. Returns the results in order"""
+        res = []
+        if self.block_size == 1:
+            for func in functions:
+                res.append(await self.connections[0].run_async(func, self.connections[0]))
+        else:
+            for block in DBBulkProcessing.blockify(functions, self.block_size):
+                res.extend(await gather(*[self.connections[i].run_async(func, self.connections[i])\
+                    for i, func in enumerate(block)]))
         return res
 
     async def executemany(self, operations: List[Tuple[str, dict]]):
         if self.block_size == 1:
             for operation in operations:
-                self.connections[0].cur.executemany(operation[0], operation[1])
+                await self.connections[0].executemany_async(operation)
         else:
             for block in DBBulkProcessing.blockify(operations, self.block_size):
                 await gather(
-                    *[self.connections[i].cur.executemany_async(operation) for i, operation in enumerate(block)])
+                    *[self.connections[i].executemany_async(operation) for i, operation in enumerate(block)])
 
     async def commit(self):
         if self.block_size == 1:
-            self.connections[0].con.commit()
+            await self.connections[0].commit_async()
         else:
-            await gather(*[c.con.commit_async() for c in self.connections])
+            await gather(*[c.commit_async() for c in self.connections])
 
     async def rollback(self):
         if self.block_size == 1:
-            self.connections[0].con.rollback()
+            await self.connections[0].rollback_async()
         else:
-            await gather(*[c.con.rollback_async() for c in self.connections])
+            await gather(*[c.rollback_async() for c in self.connections])
 
     def __exit__(self, exception_type, exception_value, traceback):
-        for db in self.connections:
-            self.connection_pool.return_connection(db)
+        self.connection_pool.return_connections(self.connections)
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        loop = get_running_loop()
+        await loop.run_in_executor(
+            self.connection_pool.executor, self.connection_pool.return_connections, self.connections)
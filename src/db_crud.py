@@ -1,13 +1,18 @@
 """ CRUD Database Operations"""
 import json
 import base64
+from functools import partial
 from hdbcli.dbapi import Error as HDBException
 
-from db_connection_pool import (DBBulkProcessing, DBConnection)
+from db_connection_pool import AsyncDBConnection, DBBulkProcessing, retry_read_async
 import server_globals as glob
-from constants import (CONCURRENT_CONNECTIONS, TYPES_B64_ENCODE, TYPES_SPATIAL,
-                       DBUserType)
+from constants import (CONCURRENT_CONNECTIONS, SOURCE_KEYS_BULK_THRESHOLD,
+                       TYPES_B64_ENCODE, TYPES_SPATIAL, DBUserType)
 import convert
+import data_diff
+from mapping_model import get_mapping_model
+import mapping_store
+from sql_statements import get_statements
 
 class CrudException(Exception):
     """ Exception in CRUD """
@@ -21,26 +26,103 @@ def get_table_sequence(mapping, table_sequence, current_table):
     table_sequence.append(current_table)
 
 
-def value_int_to_ext(typ, value):
-    if typ in TYPES_B64_ENCODE:
-        return base64.encodebytes(value).decode('utf-8')
-    elif typ in TYPES_SPATIAL:
-        return json.loads(value)
-    return value
+SOURCE_KEYS_TABLE = '#SOURCE_KEYS'
+
+
+def create_session_tables(connection):
+    """Connect hook of the write connection pool. Creates the local temporary tables of a session.
+    DDL commits the open transaction, so it must not run in the middle of a write"""
+    connection.cur.execute(f'create local temporary column table "{SOURCE_KEYS_TABLE}" '
+        '("NAME" NVARCHAR(5000), "TYPE" NVARCHAR(5000), "SID" NVARCHAR(5000))')
+    connection.session_tables.add(SOURCE_KEYS_TABLE)
+
+
+def select_source_ids(connection, schema_name, table_name, keys):
+    """Returns (_ID, NAME, TYPE, SID) of all rows of source table table_name matching keys (name, type, sid).
+    The keys are inserted into a session-local temporary table which is joined with the source table,
+    using its unique index on (NAME, TYPE, SID)"""
+    if SOURCE_KEYS_TABLE not in connection.session_tables:
+        # connection without create_session_tables hook
+        return select_source_ids_or(connection, schema_name, table_name, keys)
+    connection.execute_prepared(f'delete from "{SOURCE_KEYS_TABLE}"')
+    connection.executemany_prepared(f'insert into "{SOURCE_KEYS_TABLE}" ("NAME", "TYPE", "SID") values (?, ?, ?)',\
+        list(keys))
+    sql = (f'select S."_ID", S."NAME", S."TYPE", S."SID" from "{SOURCE_KEYS_TABLE}" K '
+        f'inner join "{schema_name}"."{table_name}" S '
+        'on S."NAME" = K."NAME" and S."TYPE" = K."TYPE" and S."SID" = K."SID"')
+    return connection.execute_prepared_fetchall(sql)
+
 
+def select_source_ids_or(connection, schema_name, table_name, keys):
+    """Same as select_source_ids for few keys, with one condition per key"""
+    where_clause = ' OR '.join(['("NAME" = ? and "TYPE" = ? and "SID" = ?)'] * len(keys))
+    sql = f'select "_ID", "NAME", "TYPE", "SID" from "{schema_name}"."{table_name}" where {where_clause}'
+    connection.cur.execute(sql, [v for key in keys for v in key])
+    return connection.cur.fetchall()
 
-def add_value(column, obj, path, value):
-    if value is None:
-        return
-    if len(path) == 1:
-        if 'type' in column:
-            obj[path[0]] = value_int_to_ext(column['type'], value)
+
+def _b64_encode(value):
+    return base64.encodebytes(value).decode('utf-8')
+
+
+def value_converter(typ):
+    """Function converting internal values of type typ to the external format (None: no conversion)"""
+    if typ in TYPES_B64_ENCODE:
+        return _b64_encode
+    elif typ in TYPES_SPATIAL:
+        return json.loads
+    return None
+
+
+def compile_assembly_plan(mapping, table):
+    """Precompiles the assembly of objects from the rows of table['sql']['select'].
+    Returns a dict with
+    - key: row index of the key the object is assigned to (pk for root tables, pkParent else)
+    - pk: row index of the primary key
+    - value: converter of the _VALUE column (only for tables of scalar arrays, row (key, pk, value))
+    - operations: list of (row index, parent path, leaf, converter, containment table name)
+      in column order. Containments have row index None and take the assembled subobjects"""
+    if '_VALUE' in table['columns']:
+        return {'key': 0, 'value': value_converter(table['columns']['_VALUE']['type'])}
+    plan = {'operations': []}
+    i = 0
+    for prop_name, prop in table['columns'].items():
+        path = prop['external_path'] if 'external_path' in prop else None
+        if prop_name == table['pk']:
+            plan['pk'] = i
+            if table['level'] == 0:
+                plan['key'] = i
+            else:
+                path = None
+        elif table['level'] > 0 and prop_name == table['pkParent']:
+            plan['key'] = i
+            path = None
+        elif 'isVirtual' in prop and prop['isVirtual']:
+            if prop['rel']['type'] == 'containment':
+                plan['operations'].append((None, tuple(path[:-1]), path[-1], None, prop['rel']['table_name']))
+            continue
+        elif 'rel' in prop and prop['rel']['type'] == 'association':
+            rel_table = mapping['tables'][prop['rel']['table_name']]
+            path = path + rel_table['columns'][rel_table['pk']]['external_path']
+        if path:
+            plan['operations'].append((i, tuple(path[:-1]), path[-1], value_converter(prop.get('type')), None))
+        i += 1
+    return plan
+
+
+def merge_patch(target, patch):
+    """JSON merge patch (RFC 7386): objects are merged recursively, null removes
+    a property, all other values (including arrays) replace the target value"""
+    if not isinstance(patch, dict):
+        return patch
+    res = dict(target) if isinstance(target, dict) else {}
+    for k, v in patch.items():
+        if v is None:
+            res.pop(k, None)
         else:
-            obj[path[0]] = value
-    else:
-        if not path[0] in obj:
-            obj[path[0]] = {}
-        add_value(column, obj[path[0]], path[1:], value)
+            res[k] = merge_patch(res.get(k), v)
+    return res
+
 
 class CRUD():
     """ DB-Operations for Create, Cread, Update, Delete """
@@ -49,6 +131,8 @@ class CRUD():
         self.schema_name = ctx['schema_name']
         #self.tenant_id = ctx['tenant_id']
         self.id_generator = ctx['id_generator']
+        self.statements = get_statements(self.schema_name, self.mapping)
+        self.model = get_mapping_model(self.schema_name, self.mapping)
 
     def _extract_object_keys(self, objects):
         obj_key_idx = {}
@@ -90,6 +174,32 @@ class CRUD():
         return obj_key_idx, obj_keys
 
 
+    async def _fetch_by_keys(self, db_bulk, requests):
+        """requests: list of (sql_template, keys). The chunks of all requests are
+        executed in parallel. Returns the rows per request"""
+        operations = []
+        owners = []
+        for i, (sql_template, keys) in enumerate(requests):
+            for operation in self.statements.operations(sql_template, keys):
+                operations.append(operation)
+                owners.append(i)
+        res = [[] for _ in requests]
+        for i, rows in zip(owners, await db_bulk.execute_prepared_fetchall(operations)):
+            res[i].extend(rows)
+        return res
+
+
+    async def _fetch_by_source_keys(self, db_bulk, requests):
+        """requests: list of (source table name, source keys). Returns the rows
+        (_ID, NAME, TYPE, SID) per request"""
+        functions = []
+        for table_name, keys in requests:
+            keys = list(keys)
+            select = select_source_ids if len(keys) > SOURCE_KEYS_BULK_THRESHOLD else select_source_ids_or
+            functions.append(partial(select, schema_name=self.schema_name, table_name=table_name, keys=keys))
+        return await db_bulk.run(functions)
+
+
     async def _classify(self, key_sql, key_promise, access_func):
         new_keys = {}
         keys_on_db = {}
@@ -187,46 +297,34 @@ class CRUD():
         for object_type, oids in obj_keys['id'].items():
             if oids:
                 table_name = self.mapping['entities'][object_type]['table_name']
-                key = set(oids)
-                ids_str = ', '.join([f"'{str(w)}'" for w in key])
-                provided_ids_sql[object_type] = {'keys': key, 'sql':
-                    f'select "ID" from "{self.schema_name}"."{table_name}" where "ID" in ({ids_str})'}
-        provided_ids_promise = db_bulk.execute_fetchall([w['sql'] for w in provided_ids_sql.values()])\
-            if provided_ids_sql else None
+                provided_ids_sql[object_type] = {'keys': set(oids), 'sql':
+                    self.statements.select_column(table_name, ('ID',), 'ID')}
+        provided_ids_promise = self._fetch_by_keys(db_bulk,\
+            [(w['sql'], w['keys']) for w in provided_ids_sql.values()]) if provided_ids_sql else None
 
         unknown_ids_sql = {}
         if 'id' in unknown_objects:
             for object_type, v in unknown_objects['id'].items():
                 table_name = self.mapping['entities'][object_type]['table_name']
-                key = set(v.keys())
-                ids_str = ', '.join([f"'{str(w)}'" for w in key])
-                unknown_ids_sql[object_type] = {'keys': key, 'sql':
-                    f'select "ID" from "{self.schema_name}"."{table_name}" where "ID" in ({ids_str})'}
-        unknown_ids_promise = db_bulk.execute_fetchall([w['sql'] for w in unknown_ids_sql.values()])\
-            if unknown_ids_sql else None
+                unknown_ids_sql[object_type] = {'keys': set(v.keys()), 'sql':
+                    self.statements.select_column(table_name, ('ID',), 'ID')}
+        unknown_ids_promise = self._fetch_by_keys(db_bulk,\
+            [(w['sql'], w['keys']) for w in unknown_ids_sql.values()]) if unknown_ids_sql else None
 
         provided_sources_sql = {}
         for object_type, source_list in obj_keys['source'].items():
             table_name = self.mapping['entities'][object_type]['elements']['source']['items']['table_name']
-            key = set(source_list)
-            where_clause = ' OR '.join(\
-            [f'("NAME" = \'{name}\' and "TYPE" = \'{type}\' and "SID" = \'{sid}\')' for name, type, sid in key])
-            provided_sources_sql[object_type] = {'keys': key, 'sql':
-                f'select "_ID", "NAME", "TYPE", "SID" from "{self.schema_name}"."{table_name}" where {where_clause}'}
-        provided_sources_promise = db_bulk.execute_fetchall([w['sql'] for w in provided_sources_sql.values()])\
-            if provided_sources_sql else None
+            provided_sources_sql[object_type] = {'keys': set(source_list), 'table_name': table_name}
+        provided_sources_promise = self._fetch_by_source_keys(db_bulk,\
+            [(w['table_name'], w['keys']) for w in provided_sources_sql.values()]) if provided_sources_sql else None
 
         unknown_sources_sql = {}
         if 'source' in unknown_objects:
             for object_type, v in unknown_objects['source'].items():
-                key = set(v.keys())
                 table_name = self.mapping['entities'][object_type]['elements']['source']['items']['table_name']
-                where_clause = ' OR '.join(\
-                [f'("NAME" = \'{name}\' and "TYPE" = \'{type}\' and "SID" = \'{sid}\')' for name, type, sid in key])
-                unknown_sources_sql[object_type] = {'keys': key, 'sql':
-                    f'select "_ID", "NAME", "TYPE", "SID" from "{self.schema_name}"."{table_name}" where {where_clause}'}
-        unknown_sources_promise = db_bulk.execute_fetchall([w['sql'] for w in unknown_sources_sql.values()])\
-            if unknown_sources_sql else None
+                unknown_sources_sql[object_type] = {'keys': set(v.keys()), 'table_name': table_name}
+        unknown_sources_promise = self._fetch_by_source_keys(db_bulk,\
+            [(w['table_name'], w['keys']) for w in unknown_sources_sql.values()]) if unknown_sources_sql else None
 
         provided_ids_new, provided_ids_on_db = await\
             self._classify(provided_ids_sql, provided_ids_promise,\
@@ -290,35 +388,125 @@ class CRUD():
             s = json.dumps(err)
             raise CrudException(f'Associated object does not exist: {s}')
 
+    async def _commit(self, db_bulk):
+        await db_bulk.commit()
+        # search results of the tenant are outdated
+        glob.search_cache.invalidate(self.schema_name)
+
+
     async def write_data(self, objects, write_mode: convert.WriteMode):
-        with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], CONCURRENT_CONNECTIONS) as db_bulk:
+        async with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], CONCURRENT_CONNECTIONS) as db_bulk:
             try:
                 await self._id_preprocessing(db_bulk, objects, write_mode)
                 res = await self._write_data(db_bulk, objects, write_mode)
-                await db_bulk.commit()
+                await self._commit(db_bulk)
             except HDBException as e:
                 await db_bulk.rollback()
                 raise CrudException(f'Data Error: {e.errortext}') from e
         return res
 
 
+    async def write_data_stream(self, batches, commit_every: int = 1):
+        """Creates objects from the async iterator batches (dicts of object lists per object type).
+        The batches are read without holding DB connections and written and committed in groups
+        of commit_every batches. References to objects of previous batches need commit_every = 1.
+        Returns one result per batch. Processing stops at the first failing batch:
+        its result contains the error and all batches of its group are rolled back."""
+        results = []
+        group = []
+        try:
+            async for objects in batches:
+                await mapping_store.preload(self.mapping, objects.keys())
+                results.append({'batch': len(results), 'objects': sum(len(w) for w in objects.values()),\
+                    'committed': False})
+                group.append((objects, results[-1]))
+                if len(group) >= commit_every:
+                    if not await self._write_batches(group):
+                        return results
+                    group = []
+        except CrudException as e:
+            # error while reading the next batch
+            results.append({'batch': len(results), 'objects': 0, 'committed': False, 'error': str(e)})
+            return results
+        if group:
+            await self._write_batches(group)
+        return results
+
+
+    async def _write_batches(self, group):
+        """Writes and commits the batches of group (list of (objects, result)) in one transaction.
+        Returns False if a batch failed, its result then contains the error"""
+        async with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], CONCURRENT_CONNECTIONS) as db_bulk:
+            result = None
+            try:
+                for objects, result in group:
+                    await self._id_preprocessing(db_bulk, objects, convert.WriteMode.CREATE)
+                    await self._write_data(db_bulk, objects, convert.WriteMode.CREATE)
+                await self._commit(db_bulk)
+            except (CrudException, HDBException) as e:
+                await db_bulk.rollback()
+                if isinstance(e, HDBException):
+                    result['error'] = f'Data Error: {e.errortext}'
+                else:
+                    result['error'] = str(e)
+                return False
+            except BaseException:
+                await db_bulk.rollback()
+                raise
+        for _, result in group:
+            result['committed'] = True
+        return True
+
+
     async def update_data(self, objects):
-        with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], CONCURRENT_CONNECTIONS) as db_bulk:
+        """The diff is written on a single connection, so that it is committed or rolled back at once"""
+        async with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], 1) as db_bulk:
             try:
                 await self._id_preprocessing(db_bulk, objects, convert.WriteMode.UPDATE)
                 res = await self._update_data(db_bulk, objects)
-                await db_bulk.commit()
+                await self._commit(db_bulk)
             except HDBException as e:
                 await db_bulk.rollback()
                 raise CrudException(f'Data Error: {e.errortext}') from e
+            except BaseException:
+                await db_bulk.rollback()
+                raise
+        return res
+
+
+    async def patch_data(self, patches):
+        """Applies merge patches to the current objects. Only the changed root columns
+        and subtable rows are written. The root rows are locked before they are read, so that
+        concurrent patches of the same objects are applied one after the other"""
+        async with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], 1) as db_bulk:
+            try:
+                for object_type, obj_list in patches.items():
+                    if isinstance(obj_list, list) and not all(isinstance(w, dict) for w in obj_list):
+                        raise CrudException(f'Data Error: patches for {object_type} must be objects')
+                plan, requests = self._plan_read(patches)
+                await self._fetch_by_keys(db_bulk, [(self.statements.lock(\
+                    self.mapping['entities'][object_type]['table_name']), ids) for object_type, ids, _ in plan])
+                objects = self._assemble_objects(plan, await self._fetch_by_keys(db_bulk, requests), False)
+                for object_type, obj_list in patches.items():
+                    objects[object_type] = [merge_patch(current, patch)\
+                        for current, patch in zip(objects[object_type], obj_list)]
+                await self._id_preprocessing(db_bulk, objects, convert.WriteMode.UPDATE)
+                res = await self._update_data(db_bulk, objects)
+                await self._commit(db_bulk)
+            except HDBException as e:
+                await db_bulk.rollback()
+                raise CrudException(f'Data Error: {e.errortext}') from e
+            except BaseException:
+                await db_bulk.rollback()
+                raise
         return res
 
 
     async def delete_data(self, objects):
-        with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], CONCURRENT_CONNECTIONS) as db_bulk:
+        async with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_WRITE], CONCURRENT_CONNECTIONS) as db_bulk:
             try:
                 res = await self._delete_data(db_bulk, objects)
-                await db_bulk.commit()
+                await self._commit(db_bulk)
             except HDBException as e:
                 await db_bulk.rollback()
                 raise CrudException(f'Data Error: {e.errortext}') from e
@@ -327,26 +515,19 @@ class CRUD():
 
     async def _write_data(self, db_bulk, objects, write_mode: convert.WriteMode):
         try:
-            dml = convert.objects_to_dml(self.mapping, objects, write_mode, self.id_generator, True)
+            dml = convert.objects_to_dml(self.mapping, objects, write_mode, self.id_generator, True, self.model)
         except convert.DataException as e:
             raise CrudException(str(e)) from e
 
         operations = []
         for table_name, v in dml['inserts'].items():
-            column_names = ','.join([f'"{k}"' for k in v['columns'].keys()])
-            cp = []
-            table = self.mapping['tables'][table_name]
-            for column_name in v['columns'].keys():
-                if table['columns'][column_name]['type'] in TYPES_SPATIAL:
-                    srid = table['columns'][column_name]['srid']
-                    cp.append(f'ST_GeomFromGeoJSON(?, {srid})')
-                else:
-                    cp.append('?')
-            column_placeholders = ','.join(cp)
-            sql = f'insert into "{self.schema_name}"."{table_name}" ({column_names}) values ({column_placeholders})'
-            operations.append((sql, v['rows']))
+            operations.append((self.statements.insert(table_name, tuple(v['columns'].keys())), v['rows']))
 
         await db_bulk.executemany(operations)
+        return self._write_response(objects)
+
+
+    def _write_response(self, objects):
         response = {}
         for object_type, obj_list in objects.items():
             root_table = self.mapping['tables'][self.mapping['entities']
@@ -366,86 +547,168 @@ class CRUD():
         return response
 
 
-    async def read_data(self, objects, type_annotation):
-        with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
-            response = {}
-            for object_type, obj_list in objects.items():
-                if not isinstance(obj_list, list):
-                    raise CrudException('provide list of objects per object type')
-                if object_type not in self.mapping['entities']:
-                    raise CrudException(f'unknown object type {object_type}')
-                root_table = self.mapping['tables'][self.mapping['entities']
-                                            [object_type]['table_name']]
-                ids = []
-                primary_key_property_name = \
-                    root_table['columns'][root_table['pk']]['external_path'][0]
-                table_sequence = []
-                get_table_sequence(self.mapping, table_sequence, root_table)
-                for obj in obj_list:
-                    if not primary_key_property_name in obj:
-                        raise CrudException(
-                            f'primary key {primary_key_property_name} not found')
-                    ids.append(obj[primary_key_property_name])
-                id_list = ', '.join([f"'{w}'" for w in ids])
-                all_objects = {}
-
-                for table in table_sequence:
-                    all_objects[table['table_name']] = {}
-                    sql = table['sql']['select'].format(
-                        schema_name=self.schema_name, id_list=id_list)
-                    db.cur.execute(sql)
-                    if '_VALUE' in table['columns']:
-                        for row in db.cur:
-                            key, _, val_int = row
-                            value = value_int_to_ext(
-                                table['columns']['_VALUE']['type'], val_int)
-                            if key in all_objects[table['table_name']]:
-                                all_objects[table['table_name']][key].append(value)
-                            else:
-                                all_objects[table['table_name']][key] = [value]
+    async def read_data(self, objects, type_annotation, ignore_missing=False):
+        plan, requests = self._plan_read(objects)
+        return await retry_read_async(lambda validate: self._read_data(\
+            plan, requests, type_annotation, validate, ignore_missing))
+
+
+    def read_data_stream(self, objects, type_annotation, chunk_size):
+        """Validates the request and returns an async generator of (object type, object).
+        The ids are read in chunks of chunk_size, so that memory does not grow with the
+        number of requested objects"""
+        self._plan_read(objects)
+        return self._read_data_stream(objects, type_annotation, chunk_size)
+
+
+    async def _read_data_stream(self, objects, type_annotation, chunk_size):
+        for object_type, obj_list in objects.items():
+            for start in range(0, len(obj_list), chunk_size):
+                res = await self.read_data({object_type: obj_list[start:start + chunk_size]}, type_annotation)
+                for obj in res[object_type]:
+                    yield object_type, obj
+
+
+    def export_data(self, object_type, type_annotation, page_size, after=None):
+        """Validates the request and returns an async generator of pages (objects, last key)
+        with all objects of object_type in primary key order, starting after key after.
+        Pages are selected by keyset pagination on the primary key of the root table"""
+        if object_type not in self.mapping['entities']:
+            raise CrudException(f'unknown object type {object_type}')
+        return self._export_data(object_type, type_annotation, page_size, after)
+
+
+    async def _export_data(self, object_type, type_annotation, page_size, after):
+        root_table = self.mapping['tables'][self.mapping['entities'][object_type]['table_name']]
+        primary_key_property_name = root_table['columns'][root_table['pk']]['external_path'][0]
+        while True:
+            if after is None:
+                operation = (self.statements.select_page(root_table['table_name'], False), [page_size])
+            else:
+                operation = (self.statements.select_page(root_table['table_name'], True), [after, page_size])
+            keys = await retry_read_async(lambda validate, operation=operation: self._select_keys(operation, validate))
+            if not keys:
+                return
+            # objects deleted in the meantime are skipped
+            res = await self.read_data({object_type: [{primary_key_property_name: w} for w in keys]},\
+                type_annotation, True)
+            after = keys[-1]
+            yield res[object_type], after
+            if len(keys) < page_size:
+                return
+
+
+    async def _select_keys(self, operation, validate):
+        async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ], validate) as db:
+            return [w[0] for w in await db.cur.execute_prepared_fetchall(operation[0], operation[1])]
+
+
+    async def _read_data(self, plan, requests, type_annotation, validate, ignore_missing=False):
+        block_size = max(1, min(CONCURRENT_CONNECTIONS, len(requests)))
+        async with DBBulkProcessing(glob.connection_pools[DBUserType.DATA_READ], block_size, validate) as db_bulk:
+            all_rows = await self._fetch_by_keys(db_bulk, requests)
+            return self._assemble_objects(plan, all_rows, type_annotation, ignore_missing)
+
+
+    def _assembly_plan(self, table):
+        """Assembly plan of table, compiled once per mapping"""
+        if not self.schema_name in glob.assembly_plans\
+            or glob.assembly_plans[self.schema_name][0] is not self.mapping:
+            glob.assembly_plans[self.schema_name] = (self.mapping, {})
+        plans = glob.assembly_plans[self.schema_name][1]
+        if not table['table_name'] in plans:
+            plans[table['table_name']] = compile_assembly_plan(self.mapping, table)
+        return plans[table['table_name']]
+
+
+    def _plan_read(self, objects):
+        """Collects the selects of all tables of all requested object types, so that
+        they can be fetched in one wave. Returns the plan (object type, ids, table sequence)
+        and the requests (select template, root ids) in plan order"""
+        plan = []
+        requests = []
+        for object_type, obj_list in objects.items():
+            if not isinstance(obj_list, list):
+                raise CrudException('provide list of objects per object type')
+            if object_type not in self.mapping['entities']:
+                raise CrudException(f'unknown object type {object_type}')
+            root_table = self.mapping['tables'][self.mapping['entities']
+                                        [object_type]['table_name']]
+            ids = []
+            primary_key_property_name = \
+                root_table['columns'][root_table['pk']]['external_path'][0]
+            table_sequence = []
+            get_table_sequence(self.mapping, table_sequence, root_table)
+            for obj in obj_list:
+                if not primary_key_property_name in obj:
+                    raise CrudException(
+                        f'primary key {primary_key_property_name} not found')
+                ids.append(obj[primary_key_property_name])
+            plan.append((object_type, ids, table_sequence))
+            requests.extend([(self.statements.select(table['table_name']), ids) for table in table_sequence])
+        return plan, requests
+
+
+    def _assemble_objects(self, plan, all_rows, type_annotation, ignore_missing=False):
+        """Assembles the objects bottom-up along the table sequences from the rows
+        fetched for the requests of _plan_read. Ids which do not exist are an error
+        unless ignore_missing is set, then they are left out"""
+        response = {}
+        all_rows = iter(all_rows)
+        for object_type, ids, table_sequence in plan:
+            root_table = table_sequence[-1]
+            all_objects = {}
+            for table in table_sequence:
+                rows = next(all_rows)
+                assembly = self._assembly_plan(table)
+                key = assembly['key']
+                table_objects = {}
+                all_objects[table['table_name']] = table_objects
+                if 'value' in assembly:
+                    converter = assembly['value']
+                    for row in rows:
+                        value = row[2]
+                        if converter and value is not None:
+                            value = converter(value)
+                        if row[key] in table_objects:
+                            table_objects[row[key]].append(value)
+                        else:
+                            table_objects[row[key]] = [value]
+                    continue
+                pk = assembly['pk']
+                operations = [(i, parent_path, leaf, converter,\
+                    all_objects[child_table_name] if child_table_name else None)\
+                    for i, parent_path, leaf, converter, child_table_name in assembly['operations']]
+                is_root = table['level'] == 0
+                for row in rows:
+                    res_obj = {'@type': object_type} if is_root and type_annotation else {}
+                    for i, parent_path, leaf, converter, child_objects in operations:
+                        if i is None:
+                            value = child_objects.get(row[pk])
+                        else:
+                            value = row[i]
+                            if converter and value is not None:
+                                value = converter(value)
+                        if value is None:
+                            continue
+                        target = res_obj
+                        for w in parent_path:
+                            if not w in target:
+                                target[w] = {}
+                            target = target[w]
+                        target[leaf] = value
+                    if is_root:
+                        table_objects[row[key]] = res_obj
+                    elif row[key] in table_objects:
+                        table_objects[row[key]].append(res_obj)
                     else:
-                        for row in db.cur:
-                            i = 0
-                            if table['level'] == 0 and type_annotation:
-                                res_obj = {'@type': object_type}
-                            else:
-                                res_obj = {}
-                            for prop_name, prop in table['columns'].items():
-                                if prop_name == table['pk']:
-                                    sub_obj_key = row[i]
-                                    if table['level'] == 0:
-                                        res_key = row[i]
-                                        add_value(prop, res_obj,
-                                                prop['external_path'], row[i])
-                                elif table['level'] > 0 and prop_name == table['pkParent']:
-                                    res_key = row[i]
-                                elif 'isVirtual' in prop and prop['isVirtual']:
-                                    if prop['rel']['type'] == 'containment':
-                                        if sub_obj_key in all_objects[prop['rel']['table_name']]:
-                                            sub_obj = all_objects[prop['rel']
-                                                                ['table_name']][sub_obj_key]
-                                            add_value(
-                                                prop, res_obj, prop['external_path'], sub_obj)
-                                    continue
-                                elif 'rel' in prop and prop['rel']['type'] == 'association':
-                                    rel_table = self.mapping['tables'][prop['rel']
-                                                                ['table_name']]
-                                    path = prop['external_path']\
-                                        + rel_table['columns'][rel_table['pk']]['external_path']
-                                    add_value(prop, res_obj, path, row[i])
-                                else:
-                                    add_value(prop, res_obj,
-                                            prop['external_path'], row[i])
-                                i += 1
-                            if table['level'] > 0:
-                                if not res_key in all_objects[table['table_name']]:
-                                    all_objects[table['table_name']][res_key] = []
-                                all_objects[table['table_name']
-                                            ][res_key].append(res_obj)
-                            else:
-                                all_objects[table['table_name']][res_key] = res_obj
-                response[object_type] = []
-                for i in ids:
+                        table_objects[row[key]] = [res_obj]
+            missing_ids = [str(w) for w in ids if not w in all_objects[root_table['table_name']]]
+            if missing_ids and not ignore_missing:
+                raise CrudException(f'Data Error: {object_type} {", ".join(missing_ids)} not found')
+            response[object_type] = []
+            for i in ids:
+                if i in all_objects[root_table['table_name']]:
                     response[object_type].append(
                         all_objects[root_table['table_name']][i])
         return response
@@ -477,22 +740,20 @@ class CRUD():
             if source_ids:
                 table_name = self.mapping['entities'][object_type]['elements']['source']['items']['table_name']
                 column_name = '_ID'
-                ids_str = ', '.join([f"'{str(w)}'" for w in source_ids])
-                read_source_sql[object_type] = \
-                    f'select "{column_name}", "NAME", "TYPE", "SID" from "{self.schema_name}"."{table_name}" where "{column_name}" in ({ids_str})'
+                read_source_sql[object_type] = (\
+                    self.statements.select_column(table_name, (column_name, 'NAME', 'TYPE', 'SID'), column_name),
+                    source_ids)
             if len(ids) != len(set(ids)):
                 raise CrudException(
                     f'Data Error: duplicates detected for {object_type}')
             table_name = root_table['table_name']
             column_name = root_table['pk']
-            ids_str = ', '.join([f"'{str(w)}'" for w in ids])
-            select_ids_sqls.append(
-                f'select "{column_name}" from "{self.schema_name}"."{table_name}" where "{column_name}" in ({ids_str})')
+            select_ids_sqls.append((self.statements.select_column(table_name, (column_name,), column_name), ids))
             all_ids[object_type] = ids
 
-        all_db_ids = await db_bulk.execute_fetchall(select_ids_sqls)
+        all_db_ids = await self._fetch_by_keys(db_bulk, select_ids_sqls)
         if read_source_sql:
-            all_sources = await db_bulk.execute_fetchall([w for w in read_source_sql.values()])
+            all_sources = await self._fetch_by_keys(db_bulk, list(read_source_sql.values()))
 
         for i, (object_type, ids) in enumerate(all_ids.items()):
             db_ids = [w[0] for w in all_db_ids[i]]
@@ -519,13 +780,65 @@ class CRUD():
                         if obj['id'] in source_objects[object_type]:
                             obj['source'] = source_objects[object_type][obj['id']]
 
-        await self._delete_data(db_bulk, objects)
-        await db_bulk.commit()
-        return await self._write_data(db_bulk, objects, convert.WriteMode.UPDATE)
+        await self._write_diff(db_bulk, objects, all_ids)
+        return self._write_response(objects)
+
+
+    async def _write_diff(self, db_bulk, objects, all_ids):
+        """Writes only the differences between objects and their rows on the DB:
+        changed columns of root tables are updated, subtable rows are deleted or inserted"""
+        try:
+            dml = convert.objects_to_dml(self.mapping, objects, convert.WriteMode.UPDATE, self.id_generator, True,\
+                self.model)
+        except convert.DataException as e:
+            raise CrudException(str(e)) from e
+        new_rows = {}
+        for table_name, v in dml['inserts'].items():
+            new_rows[table_name] = [{k: row[idx] for k, idx in v['columns'].items()} for row in v['rows']]
+
+        table_sequences = {}
+        requests = []
+        for object_type, ids in all_ids.items():
+            root_table = self.mapping['tables'][self.mapping['entities'][object_type]['table_name']]
+            table_sequence = []
+            get_table_sequence(self.mapping, table_sequence, root_table)
+            table_sequences[object_type] = table_sequence
+            for table in table_sequence:
+                requests.append((self.statements.select(table['table_name']), ids))
+        fetched = iter(await self._fetch_by_keys(db_bulk, requests))
+
+        delete_operations = []
+        write_operations = []
+        for object_type, table_sequence in table_sequences.items():
+            old_rows = {}
+            for table in table_sequence:
+                column_names = self.model.table(table['table_name']).physical
+                old_rows[table['table_name']] = [dict(zip(column_names, row)) for row in next(fetched)]
+            diff = data_diff.ObjectDiff(self.mapping, self.mapping['entities'][object_type]['table_name'], self.model)
+            diff.compare(old_rows, {t['table_name']: new_rows.get(t['table_name'], []) for t in table_sequence})
+            for table_name, keys in diff.deletes.items():
+                delete_operations.extend(self.statements.operations(self.statements.delete_by_pk(table_name), keys))
+            for table_name, rows in diff.inserts.items():
+                columns = tuple(dml['inserts'][table_name]['columns'].keys())
+                write_operations.append((self.statements.insert(table_name, columns),\
+                    [[row[w] for w in columns] for row in rows]))
+            for table_name, changes in diff.updates.items():
+                pk = self.mapping['tables'][table_name]['pk']
+                by_columns = {}
+                for changed, row in changes:
+                    if not changed in by_columns:
+                        by_columns[changed] = []
+                    by_columns[changed].append([row.get(w) for w in changed] + [row[pk]])
+                for changed, rows in by_columns.items():
+                    write_operations.append((self.statements.update(table_name, changed), rows))
+        if delete_operations:
+            await db_bulk.execute_prepared(delete_operations)
+        if write_operations:
+            await db_bulk.executemany(write_operations)
 
 
     async def _delete_data(self, db_bulk, objects):
-        sqls = []
+        operations = []
         for object_type, obj_list in objects.items():
             if not isinstance(obj_list, list):
                 raise CrudException('provide list of objects per object type')
@@ -543,11 +856,9 @@ class CRUD():
                     raise CrudException(
                         f'primary key {primary_key_property_name} not found')
                 ids.append(obj[primary_key_property_name])
-            id_list = ', '.join([f"'{w}'" for w in ids])
 
             for table in table_sequence:
-                sqls.append(table['sql']['delete'].format(
-                    schema_name=self.schema_name, id_list=id_list))
-        if sqls:
-            await db_bulk.execute(sqls)
+                operations.extend(self.statements.operations(self.statements.delete(table['table_name']), ids))
+        if operations:
+            await db_bulk.execute_prepared(operations)
         return None
@@ -1,14 +1,21 @@
 import uuid
+from asyncio import create_task, gather
 import json
+import logging
 import re
+from hdbcli.dbapi import Error as HDBException
 
 
-from db_connection_pool import DBConnection
+from db_connection_pool import AsyncDBConnection, DBConnection, retry_read, retry_read_async
 import server_globals as glob
 from constants import (DBUserType, ENTITY_PREFIX)
 import query_mapping
 import convert
-from column_view import ColumnView
+from column_view import ColumnView, association_prefix
+from mapping_model import MappingModel, get_mapping_model
+import mapping_store
+from search_cache import MetadataEntry
+from view_cache import CachedView, LibraryView, ViewLibrary
 from esh_objects import map_query, PropertyInternal
 import db_crud as crud
 import server_globals as glob
@@ -36,6 +43,98 @@ def _cleanse_output(res):
     return res
     
 
+def _view_map(cv):
+    return {k: v for k, _, _, _, v in cv.view_attribute}
+
+
+def _new_cached_view(mapping, anchor_entity_name, schema_name, path_list):
+    cv = _get_column_view(mapping, anchor_entity_name, schema_name, path_list)
+    view_ddl, esh_config = cv.data_definition()
+    return CachedView(cv, view_ddl, esh_config['content'], _view_map(cv))
+
+
+def _path_info(model: MappingModel, entity_name, path):
+    """(is valid, is cross entity, association prefix) of path of entity entity_name,
+    computed once per mapping"""
+    key = (entity_name, tuple(path))
+    if not key in model.paths:
+        entity = model.mapping['entities'][entity_name]
+        is_valid, is_cross = convert.check_path(model.mapping, entity, path)
+        model.paths[key] = (is_valid, is_cross, association_prefix(model.mapping, entity, path) if is_valid else None)
+    return model.paths[key]
+
+
+def _view_key(model: MappingModel, anchor_entity_name, pathes):
+    return frozenset(w for w in (_path_info(model, anchor_entity_name, p)[2] for p in pathes) if w)
+
+
+def _build_view_library(model: MappingModel, anchor_entity_name, schema_name):
+    mapping = model.mapping
+    anchor_entity = mapping['entities'][anchor_entity_name]
+    if 'annotations' in anchor_entity and '@EnterpriseSearch.enabled' in anchor_entity['annotations']:
+        if not anchor_entity['annotations']['@EnterpriseSearch.enabled']:
+            return ViewLibrary({})
+        default_annotations = False
+    else:
+        default_annotations = True
+    cv = ColumnView(mapping, anchor_entity_name, schema_name, default_annotations)
+    cv.by_default()
+    cv.data_definition()
+    library = {frozenset(): [LibraryView(cv.odata_name, None, _view_map(cv))]}
+    if 'search_views' in anchor_entity:
+        for search_view in anchor_entity['search_views']:
+            cv = ColumnView(mapping, anchor_entity_name, schema_name, default_annotations)
+            cv.by_default_and_path_list(search_view['path_list'], search_view['view_name'], search_view['odata_name'])
+            _, esh_config = cv.data_definition()
+            key = _view_key(model, anchor_entity_name, search_view['path_list'])
+            if not key in library:
+                library[key] = []
+            library[key].append(LibraryView(cv.odata_name, esh_config['content'], _view_map(cv)))
+    return ViewLibrary(library)
+
+
+def _library_view(model: MappingModel, anchor_entity_name, schema_name, pathes):
+    """Column view created at deploy time (default view or search view) which contains
+    all pathes, None if there is none. Candidates are the views joining at least the associations
+    the pathes cross, those with the fewest associations (the default view first) are preferred"""
+    if not schema_name in glob.view_libraries or glob.view_libraries[schema_name][0] is not model.mapping:
+        glob.view_libraries[schema_name] = (model.mapping, {})
+    libraries = glob.view_libraries[schema_name][1]
+    if not anchor_entity_name in libraries:
+        libraries[anchor_entity_name] = _build_view_library(model, anchor_entity_name, schema_name)
+    return libraries[anchor_entity_name].find(pathes, lambda: _view_key(model, anchor_entity_name, pathes))
+
+
+async def _create_views(views):
+    try:
+        async with AsyncDBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
+            for view in views:
+                await db.cur.execute(view.ddl)
+                glob.view_cache.created(view)
+    except BaseException as e:
+        error = e if isinstance(e, Exception) else SearchException('creation of column view cancelled')
+        for view in views:
+            if not view.ready.done():
+                glob.view_cache.created(view, error)
+        raise
+
+
+async def drop_cached_views():
+    """Drops all cached column views, e.g. at shutdown"""
+    views = glob.view_cache.clear()
+    if views:
+        await _drop_views(views)
+
+
+async def _drop_views(views):
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
+        for schema_name, view_name in views:
+            try:
+                await db.cur.execute(f'drop view "{schema_name}"."{view_name}"')
+            except HDBException as e:
+                logging.warning('Drop of column view %s.%s failed: %s', schema_name, view_name, e.errortext)
+
+
 def _get_column_view(mapping, anchor_entity_name, schema_name, path_list):
     view_id = str(uuid.uuid4()).replace('-', '').upper()
     view_name = f'DYNAMICVIEW/{view_id}'
@@ -49,31 +148,148 @@ def _get_column_view(mapping, anchor_entity_name, schema_name, path_list):
     return cv
 
 
+def _call_esh_search(params, validate):
+    with DBConnection(glob.connection_pools[DBUserType.DATA_READ], validate) as db:
+        db.cur.callproc('esh_search', params)
+        return db.cur.fetchall()
+
+
+async def _call_esh_search_async(params, validate):
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ], validate) as db:
+        await db.cur.callproc('esh_search', params)
+        return await db.cur.fetchall()
+
+
 def perform_search(esh_version, schema_name, esh_query, is_metadata=False):
     # logging.info(search_query)
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
-        search_params = (json.dumps(
-            [f'/{_get_esh_version(esh_version)}/{schema_name}{esh_query}']), None)
-        db.cur.callproc('esh_search', search_params)
-        for row in db.cur.fetchall():
-            if is_metadata:
-                return row[0]
-            else:
-                return _cleanse_output(json.loads(row[0]))
+    esh_version = _get_esh_version(esh_version)
+    key = (schema_name, esh_version, esh_query, is_metadata)
+    res = glob.search_cache.get(key)
+    if res is not None:
+        return res
+    generation = glob.search_cache.generation(schema_name)
+    search_params = (json.dumps(
+        [f'/{esh_version}/{schema_name}{esh_query}']), None)
+    for row in retry_read(lambda validate: _call_esh_search(search_params, validate)):
+        if is_metadata:
+            res = row[0]
+        else:
+            res = _cleanse_output(json.loads(row[0]))
+        glob.search_cache.put(key, res, len(row[0]), generation)
+        return res
     return None
 
 
+def _is_error(content):
+    try:
+        return 'error' in json.loads(content)
+    except ValueError:
+        return False
+
+
+async def get_metadata(esh_version, schema_name, control_version, path=''):
+    """$metadata document of a tenant (MetadataEntry). The document only changes
+    when the model is deployed, so it is read from ESH once per version of the control
+    data and then cached. Empty documents and errors are not cached"""
+    esh_version = _get_esh_version(esh_version)
+    key = (schema_name, control_version, esh_version, path)
+    entry = glob.metadata_cache.get(key)
+    if entry is not None:
+        return entry
+    generation = glob.metadata_cache.generation(schema_name)
+    search_params = (json.dumps(
+        [f'/{esh_version}/{schema_name}/$metadata{path}']), None)
+    rows = await retry_read_async(lambda validate: _call_esh_search_async(search_params, validate))
+    content = rows[0][0] if rows and rows[0][0] else ''
+    entry = MetadataEntry(content.encode('utf-8'))
+    if content and not _is_error(content):
+        glob.metadata_cache.put(key, entry, entry.size, generation)
+    return entry
+
+
 def perform_bulk_search(esh_version, schema_name, esh_query):
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
-        payload = [
-            f'/{_get_esh_version(esh_version)}/{schema_name}/{w}' for w in esh_query]
-        params = (json.dumps([{'URI': payload}]), None)
-        db.cur.callproc('esh_search', params)
-        return [_cleanse_output(json.loads(w[0])) for w in db.cur.fetchall()]
+    esh_version = _get_esh_version(esh_version)
+    payload = [
+        f'/{esh_version}/{schema_name}/{w}' for w in esh_query]
+    key = (schema_name, esh_version, tuple(payload))
+    res = glob.search_cache.get(key)
+    if res is not None:
+        return res
+    generation = glob.search_cache.generation(schema_name)
+    params = (json.dumps([{'URI': payload}]), None)
+    rows = retry_read(lambda validate: _call_esh_search(params, validate))
+    res = [_cleanse_output(json.loads(w[0])) for w in rows]
+    glob.search_cache.put(key, res, sum(len(w[0]) for w in rows), generation)
+    return res
+
+
+def query_scopes(queries):
+    """Entity names of the scopes of queries"""
+    res = set()
+    for query in queries:
+        if isinstance(query.scope, str):
+            res.add(query.scope)
+        elif isinstance(query.scope, list):
+            res.update(query.scope)
+    return res
+
+
+async def search_query(schema_name, mapping, esh_version, queries, crud, *, control_version, encode):
+    """Search result serialized by encode. Results are cached per version of the control data,
+    so that deployments by other workers are reflected once the control data is revalidated"""
+    key = (schema_name, control_version, _get_esh_version(esh_version),\
+        json.dumps([w.dict() for w in queries], sort_keys=True, default=str))
+    res = glob.search_cache.get(key)
+    if res is not None:
+        return res
+    generation = glob.search_cache.generation(schema_name)
+    views = []
+    try:
+        res = encode(await _search_query(schema_name, mapping, esh_version, queries, crud, views))
+        glob.search_cache.put(key, res, len(res), generation)
+        return res
+    finally:
+        for view in views:
+            glob.view_cache.release(view)
+        evicted = glob.view_cache.take_evicted()
+        if evicted:
+            await _drop_views(evicted)
+
+
+async def _search_and_read(esh_query, mapping, odata_map, crud):
+    """Searches one query and reads the found objects.
+    Returns (search result, {entity type: {id: object}})"""
+    params = (json.dumps([esh_query]), None)
+    rows = await retry_read_async(lambda validate: _call_esh_search_async(params, validate))
+    search_result = json.loads(rows[0][0])
+    if 'error' in search_result:
+        raise SearchException(json.dumps([search_result]))
+    read_request = {}
+    for itm in search_result['value']:
+        if itm['@odata.context'] in odata_map:
+            entity_type = odata_map[itm['@odata.context']]['entity_type']
+        else:
+            entity_type = mapping['tables'][ENTITY_PREFIX +
+                                            itm['@odata.context'][10:]]['external_path'][0]
+            odata_map[itm['@odata.context']]['entity_type'] = entity_type
+        if not entity_type in read_request:
+            read_request[entity_type] = []
+        read_request[entity_type].append({'id': itm['ID']})
+    if not read_request:
+        return search_result, {}
+    await mapping_store.preload(mapping, read_request.keys())
+    full_objects = await crud.read_data(read_request, True)
+    full_objects_idx = {}
+    for k, v in full_objects.items():
+        full_objects_idx[k] = {}
+        for i in v:
+            full_objects_idx[k][i['id']] = i
+    return search_result, full_objects_idx
 
 
-async def search_query(schema_name, mapping, esh_version, queries, crud):
-    dynamic_views = {}
+async def _search_query(schema_name, mapping, esh_version, queries, crud, views):
+    model = get_mapping_model(schema_name, mapping)
+    new_views = []
     odata_map = {}
     esh_queries = []
     for query in queries:
@@ -94,26 +310,27 @@ async def search_query(schema_name, mapping, esh_version, queries, crud):
                 #handle_error(f'unknown entity {scope}', 400)
             is_cross_entity = False
             for path in pathes:
-                is_valid, is_cross = convert.check_path(
-                    mapping, mapping['entities'][scope], path)
+                is_valid, is_cross, _ = _path_info(model, scope, path)
                 if not is_valid:
                     raise SearchException(f'invalid path {path} for entity {scope}')
                     #handle_error(f'invalid path {path} for entity {scope}', 400)
                 is_cross_entity = is_cross_entity or is_cross
             # if is_cross_entity:
                 # ToDo: support free-style
-            cv = _get_column_view(mapping, scope, schema_name, pathes.keys())
-            esh_scopes.append(cv.odata_name)
-            view_ddl, esh_config = cv.data_definition()
-            configurations.append(esh_config['content'])
-            view_map = {k: v for k, _, _, _, v in cv.view_attribute}
+            view = _library_view(model, scope, schema_name, pathes.keys())
+            if not view:
+                view, is_new = glob.view_cache.acquire((schema_name, scope, frozenset(pathes.keys())),\
+                    lambda: _new_cached_view(mapping, scope, schema_name, pathes.keys()))
+                views.append(view)
+                if is_new:
+                    new_views.append(view)
+            esh_scopes.append(view.odata_name)
+            if view.configuration:
+                configurations.append(view.configuration)
             odata_map['$metadata#' +
-                      cv.odata_name] = {'entity_type': scope, 'view_map': view_map}
-            dynamic_views[cv.view_name] = {'ddl': view_ddl}
-            # else:
-            #    esh_scopes.append(mapping['entities'][scope]['table_name'][len(ENTITY_PREFIX):])
+                      view.odata_name] = {'entity_type': scope, 'view_map': view.view_map}
             for path in pathes.keys():
-                pathes[path] = cv.column_name_by_path(path)
+                pathes[path] = view.column_name_by_path(path)
 
         query_mapping.map_query(query, pathes)
         query.scope = esh_scopes
@@ -126,45 +343,22 @@ async def search_query(schema_name, mapping, esh_version, queries, crud):
         if configurations:
             esh_query['Configuration'] = configurations
         esh_queries.append(esh_query)
-    if dynamic_views:
-        with DBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
-            for dynamic_view in dynamic_views.values():
-                db.cur.execute(dynamic_view['ddl'])
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
-        params = (json.dumps(esh_queries), None)
-        db.cur.callproc('esh_search', params)
-        search_results = [json.loads(w[0]) for w in db.cur.fetchall()]
-    if dynamic_views:
-        with DBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
-            for view_name in dynamic_views:
-                sql = f'drop view "{schema_name}"."{view_name}"'
-                db.cur.execute(sql)
-    read_request = {}
-    for search_result in search_results:
-        if 'error' in search_result:
-            raise SearchException(json.dumps(search_results))
-            #handle_error(json.dumps(search_results))
-        for itm in search_result['value']:
-            if itm['@odata.context'] in odata_map:
-                entity_type = odata_map[itm['@odata.context']]['entity_type']
-            else:
-                entity_type = mapping['tables'][ENTITY_PREFIX +
-                                                itm['@odata.context'][10:]]['external_path'][0]
-                odata_map[itm['@odata.context']]['entity_type'] = entity_type
-            if not entity_type in read_request:
-                read_request[entity_type] = []
-            read_request[entity_type].append({'id': itm['ID']})
-
-    #full_objects = await read_data(schema_name, mapping, read_request, True)
-    full_objects = await crud.read_data(read_request, True)
-    full_objects_idx = {}
-    for k, v in full_objects.items():
-        full_objects_idx[k] = {}
-        for i in v:
-            full_objects_idx[k][i['id']] = i
+    if new_views:
+        await _create_views(new_views)
+    for view in views:
+        await view.ready
+    # each query is searched and its objects are read independently, so that the
+    # requests of all queries overlap
+    tasks = [create_task(_search_and_read(w, mapping, odata_map, crud)) for w in esh_queries]
+    try:
+        searched = await gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
 
     results = []
-    for i, search_result in enumerate(search_results):
+    for search_result, full_objects_idx in searched:
         result = {'value': []}
         for itm in search_result['value']:
             r = {}
@@ -0,0 +1,95 @@
+"""Compact, immutable representation of the tables of a tenant mapping.
+Tables are compiled on first use into NamedTuples with interned names and precomputed
+column flags, so that the hot paths (conversion to DML, diff of updates, search) do not
+repeat string key lookups like 'isVirtual' in column and column['isVirtual']"""
+import base64
+import json
+import sys
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Tuple
+
+from constants import TYPES_B64_DECODE, TYPES_B64_ENCODE, TYPES_SPATIAL
+import server_globals as glob
+
+
+class Column(NamedTuple):
+    """Column of a table with the flags of its type and relation"""
+    name: str
+    type: Optional[str]
+    external_path: Tuple[str, ...]
+    is_virtual: bool
+    is_association: bool
+    is_containment: bool
+    is_spatial: bool
+    b64_encode: bool
+    b64_decode: bool
+    rel_table_name: Optional[str]
+
+    def ext_to_int(self, value):
+        """Converts a value of the external format to the value written to the DB"""
+        if self.b64_decode:
+            return base64.decodebytes(value.encode('utf-8'))
+        if self.is_spatial:
+            return json.dumps(value)
+        return value
+
+
+class Table(NamedTuple):
+    """Table with its columns by name, the physical column names in the order of
+    table['sql']['select'], the data columns (without keys) and the subtable names"""
+    name: str
+    pk: str
+    pk_parent: Optional[str]
+    level: int
+    columns: MappingProxyType
+    physical: Tuple[str, ...]
+    data: Tuple[Column, ...]
+    children: Tuple[str, ...]
+
+    def column(self, name) -> Column:
+        return self.columns[name]
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def compile_column(name, column) -> Column:
+    typ = _intern(column.get('type'))
+    rel = column.get('rel')
+    return Column(_intern(name), typ, tuple(_intern(w) for w in column.get('external_path', ())),
+        bool(column.get('isVirtual')), bool(rel) and rel['type'] == 'association',
+        bool(rel) and rel['type'] == 'containment', typ in TYPES_SPATIAL,
+        typ in TYPES_B64_ENCODE, typ in TYPES_B64_DECODE, _intern(rel['table_name']) if rel else None)
+
+
+def compile_table(table) -> Table:
+    columns = {k: compile_column(k, v) for k, v in table['columns'].items()}
+    pk_parent = table.get('pkParent')
+    physical = tuple(w.name for w in columns.values() if not w.is_virtual)
+    data = tuple(columns[w] for w in physical if w not in (table['pk'], pk_parent))
+    children = tuple(w.rel_table_name for w in columns.values() if w.is_containment)
+    return Table(_intern(table['table_name']), _intern(table['pk']), _intern(pk_parent), table['level'],
+        MappingProxyType(columns), physical, data, children)
+
+
+class MappingModel():
+    """Compiled tables of a mapping. paths caches results per (entity name, path) of the search"""
+    __slots__ = ('mapping', 'tables', 'paths')
+
+    def __init__(self, mapping) -> None:
+        self.mapping = mapping
+        self.tables = {}
+        self.paths = {}
+
+    def table(self, table_name) -> Table:
+        if not table_name in self.tables:
+            self.tables[table_name] = compile_table(self.mapping['tables'][table_name])
+        return self.tables[table_name]
+
+
+def get_mapping_model(schema_name, mapping) -> MappingModel:
+    """Compiled model of a tenant mapping, replaced when the mapping is reloaded"""
+    if not schema_name in glob.mapping_models or glob.mapping_models[schema_name].mapping is not mapping:
+        glob.mapping_models[schema_name] = MappingModel(mapping)
+    return glob.mapping_models[schema_name]
@@ -0,0 +1,131 @@
+"""Split storage of tenant mappings in _CONTROL and lazy loading of their parts.
+A split mapping is stored as one row MAPPING_INDEX and one row MAPPING/<part number> per
+entity, containing the entity and all its tables"""
+from collections.abc import Mapping
+from threading import Lock
+
+from control_cache import parse_mapping
+
+MAPPING_INDEX = 'MAPPING_INDEX'
+MAPPING_PART_PREFIX = 'MAPPING/'
+SECTIONS = ('entities', 'tables')
+
+
+def _entity_tables(mapping, table_name, res):
+    res.append(table_name)
+    for column in mapping['tables'][table_name]['columns'].values():
+        if 'rel' in column and column['rel']['type'] == 'containment':
+            _entity_tables(mapping, column['rel']['table_name'], res)
+
+
+def split_mapping(mapping):
+    """Returns the index {section: {name: part number}} and the list of parts
+    {section: {name: definition}} of mapping"""
+    index = {w: {} for w in SECTIONS}
+    parts = []
+    for entity_name, entity in mapping['entities'].items():
+        table_names = []
+        if 'table_name' in entity and entity['table_name'] in mapping['tables']:
+            _entity_tables(mapping, entity['table_name'], table_names)
+        index['entities'][entity_name] = len(parts)
+        for table_name in table_names:
+            index['tables'][table_name] = len(parts)
+        parts.append({'entities': {entity_name: entity},\
+            'tables': {w: mapping['tables'][w] for w in table_names}})
+    rest = {k: v for k, v in mapping['tables'].items() if not k in index['tables']}
+    if rest:
+        for table_name in rest:
+            index['tables'][table_name] = len(parts)
+        parts.append({'entities': {}, 'tables': rest})
+    return index, parts
+
+
+class PartNotLoadedException(Exception):
+    """A definition of a split mapping was accessed before its part was loaded with preload"""
+
+
+class PartLoader():
+    """Holds the loaded parts of a split mapping. load_parts_async(part numbers) returns the
+    JSON per part number, on_load(size) is called with the size of every loaded part.
+    Parts are only loaded by load, accessing a part which is not loaded raises
+    PartNotLoadedException, so that the event loop is never blocked by a DB call"""
+
+    def __init__(self, index, load_parts_async, on_load=None) -> None:
+        self.index = index
+        self.load_parts_async = load_parts_async
+        self.on_load = on_load
+        self.sections = {w: {} for w in SECTIONS}
+        self.loaded = set()
+        self.lock = Lock()
+
+    def _add(self, part_number, content):
+        with self.lock:
+            if part_number in self.loaded:
+                return
+            for part_section, items in parse_mapping(content).items():
+                self.sections[part_section].update(items)
+            self.loaded.add(part_number)
+        if self.on_load:
+            self.on_load(len(content))
+
+    def get(self, section, key):
+        values = self.sections[section]
+        if key in values:
+            return values[key]
+        if key in self.index[section]:
+            raise PartNotLoadedException(f'{section} {key} of part {self.index[section][key]} is not loaded')
+        raise KeyError(key)
+
+    async def load(self, part_numbers):
+        """Loads the parts part_numbers which are not loaded yet"""
+        missing = sorted(set(part_numbers) - self.loaded)
+        if missing:
+            for part_number, content in (await self.load_parts_async(missing)).items():
+                self._add(part_number, content)
+
+
+class LazySection(Mapping):
+    """Read-only section (entities or tables) of a split mapping. Names are known
+    from the index, definitions are available after their parts are preloaded"""
+
+    def __init__(self, loader: PartLoader, section: str) -> None:
+        self.loader = loader
+        self.section = section
+
+    def __getitem__(self, key):
+        return self.loader.get(self.section, key)
+
+    def __contains__(self, key):
+        return key in self.loader.index[self.section]
+
+    def __iter__(self):
+        return iter(self.loader.index[self.section])
+
+    def __len__(self):
+        return len(self.loader.index[self.section])
+
+
+def lazy_mapping(loader: PartLoader):
+    return {w: LazySection(loader, w) for w in SECTIONS}
+
+
+async def preload(mapping, entity_names=None):
+    """Loads the parts of a split mapping needed by entity_names (all parts if None) before
+    they are accessed. Needed are the parts of the entities and of all
+    tables reachable by relations from their tables. Mappings which are not split are left as is"""
+    if not mapping or not isinstance(mapping['entities'], LazySection):
+        return
+    loader = mapping['entities'].loader
+    if entity_names is None:
+        await loader.load(set(loader.index['entities'].values()) | set(loader.index['tables'].values()))
+        return
+    part_numbers = set(loader.index['entities'][w] for w in entity_names if w in loader.index['entities'])
+    while part_numbers:
+        await loader.load(part_numbers)
+        referenced = set()
+        for table_name, part_number in loader.index['tables'].items():
+            if part_number in part_numbers:
+                for column in loader.sections['tables'][table_name]['columns'].values():
+                    if 'rel' in column and column['rel']['table_name'] in loader.index['tables']:
+                        referenced.add(loader.index['tables'][column['rel']['table_name']])
+        part_numbers = referenced - loader.loaded
@@ -0,0 +1,112 @@
+"""Cache of search results per tenant"""
+import gzip
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+
+
+class SearchCache():
+    """LRU cache of search results keyed by tuples starting with the tenant schema name,
+    limited in the total size of the results. Results expire after ttl seconds.
+    Every write to a tenant increments its write generation. Results are stored with the
+    generation read before the search started and are only returned while the generation
+    is unchanged, so that results of searches which overlap a write are never returned.
+    Generations are per worker, writes done by other workers become visible after ttl seconds.
+    clock returns the current time in seconds"""
+
+    def __init__(self, max_bytes: int, ttl: float, clock=monotonic) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def generation(self, schema_name):
+        with self.lock:
+            return self.generations.get(schema_name, 0)
+
+    def get(self, key):
+        """Returns the cached result, None if there is no valid one"""
+        with self.lock:
+            if key in self.entries:
+                generation, expires_at, size, value = self.entries[key]
+                if generation == self.generations.get(key[0], 0) and self.clock() < expires_at:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.size -= size
+            self.misses += 1
+            return None
+
+    def put(self, key, value, size: int, generation):
+        with self.lock:
+            if generation != self.generations.get(key[0], 0) or size > self.max_bytes:
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[2]
+            self.entries[key] = (generation, self.clock() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted_size, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, schema_name):
+        """Data or model of a tenant changed. The results of the tenant are dropped lazily"""
+        with self.lock:
+            self.generations[schema_name] = self.generations.get(schema_name, 0) + 1
+            self.invalidations += 1
+
+    def metrics(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'results': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / requests if requests else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
+
+
+class MetadataEntry():
+    """$metadata document with its gzip compressed body and an ETag per encoding, computed once"""
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.gzip_body = gzip.compress(body)
+        digest = sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.size = len(body) + len(self.gzip_body)
+
+    def matches(self, if_none_match: str, etag: str):
+        """if_none_match (header If-None-Match) contains etag (of the sent encoding)"""
+        tags = [w.strip() for w in if_none_match.split(',')]
+        return '*' in tags or any(w.removeprefix('W/') == etag for w in tags)
+
+
+def accepts_gzip(accept_encoding: str):
+    """accept_encoding (header Accept-Encoding) accepts gzip, i.e. gzip or * with a q-value above 0"""
+    qvalues = {}
+    for coding in accept_encoding.split(','):
+        name, *params = [w.strip() for w in coding.split(';')]
+        qvalue = 1.0
+        for param in params:
+            if param.lower().startswith('q='):
+                try:
+                    qvalue = float(param[2:])
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[name.lower()] = qvalue
+    return qvalues.get('gzip', qvalues.get('*', 0.0)) > 0
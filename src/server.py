@@ -1,20 +1,25 @@
 '''
 Provides HTTP(S) interfaces
 '''
+import asyncio
+import base64
+import binascii
 import json
 import logging
 import sys
 import uuid
 from datetime import datetime
+from decimal import Decimal
+from functools import partial
 from typing import List
-from time import sleep
 
 import httpx
+import orjson
 import uvicorn
 from fastapi import Body, FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from hdbcli.dbapi import Error as HDBException
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, StreamingResponse
 from hdbcli.dbapi import Error as HDBException
 from hdbcli.dbapi import ProgrammingError as HDBExceptionProgrammingError
 from pydantic import BaseModel, ValidationError
@@ -25,15 +30,22 @@ import consistency_check
 import convert
 import sqlcreate
 from config import get_user_name
-from constants import (CONCURRENT_CONNECTIONS,
+from control_cache import ControlCache, ControlEntry, parse_mapping
+import mapping_store
+from mapping_store import MAPPING_INDEX, MAPPING_PART_PREFIX, PartLoader, lazy_mapping
+from constants import (CONCURRENT_CONNECTIONS, CONTROL_CACHE_DEFAULTS, INGEST_BATCH_SIZE,
+                       METADATA_CACHE_DEFAULTS, POOL_DEFAULTS, READ_CHUNK_SIZE,
+                       SEARCH_CACHE_DEFAULTS, VIEW_CACHE_DEFAULTS,
                        TENANT_ID_MAX_LENGTH, TENANT_PREFIX, DBUserType)
 from db_connection_pool import (
-    ConnectionPool, Credentials, DBBulkProcessing, DBConnection)
+    AsyncDBConnection, ConnectionPool, Credentials, DBBulkProcessing, DBConnection, retry_read_async)
 from esh_client import EshObject, EshRequest, SearchRuleSet
 from esh_objects import convert_search_rule_set_query_to_string, generate_search_rule_set_query
 from request_mapping import map_request_to_rule_set, map_request_to_rule_set_old
 import db_crud as crud
 import db_search as search
+from search_cache import SearchCache, accepts_gzip
+from view_cache import ViewCache
 
 # run with uvicorn src.server:app --reload
 app = FastAPI()
@@ -43,46 +55,127 @@ app.mount('/static', StaticFiles(directory='static'), name='static')
 LENGTH_ODATA_METADATA_PREFIX = len('$metadata#')
 
 
-def get_IdGenerator(tenant_id, schema_name):
-    if not schema_name in glob.id_generator:
-        refresh_control_buffer(tenant_id, schema_name)
-    return glob.id_generator[schema_name]
-
-
-def refresh_control_buffer(tenant_id, schema_name):
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
+async def read_control(schema_name, validate, content=True):
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ], validate) as db:
+        columns = 'TYPE, CREATED_AT, CONTENT' if content else 'TYPE, CREATED_AT'
+        sql = f'select {columns} from "{schema_name}"."_CONTROL" '\
+            f'where "TYPE" in (\'MAPPING\', \'{MAPPING_INDEX}\', \'TENANT_CONFIG\')'
         try:
-            sql = f'select TYPE, CONTENT from "{schema_name}"."_CONTROL" where "TYPE" in (\'MAPPING\', \'TENANT_CONFIG\')'
-            db.cur.execute(sql)
-            res = db.cur.fetchall()
-        except HDBException as e:
-            db.cur.connection.rollback()
-            if e.errorcode == 362:
-                handle_error(
-                    f"Tennant id '{tenant_id}' does not exist", 404)
-            else:
-                handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
-    glob.mapping[schema_name] = None
-    glob.id_generator[schema_name] = None
+            await db.cur.execute(sql)
+            return await db.cur.fetchall()
+        except HDBException:
+            await db.rollback()
+            raise
+
+
+async def read_control_parts(schema_name, part_numbers, validate):
+    """JSON of parts of a split mapping by part number"""
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ], validate) as db:
+        types = [f'{MAPPING_PART_PREFIX}{w}' for w in part_numbers]
+        sql = f'select TYPE, CONTENT from "{schema_name}"."_CONTROL" where "TYPE" in ({", ".join(["?"] * len(types))})'
+        try:
+            await db.cur.execute(sql, types)
+            rows = await db.cur.fetchall()
+        except HDBException:
+            await db.rollback()
+            raise
+    res = {int(w[0][len(MAPPING_PART_PREFIX):]): w[1] for w in rows}
+    for part_number in part_numbers:
+        if not part_number in res:
+            raise KeyError(f'{MAPPING_PART_PREFIX}{part_number}')
+    return res
+
+
+def control_version(rows):
+    return tuple(sorted([(w[0], str(w[1])) for w in rows]))
+
+
+async def get_control(tenant_id, schema_name) -> ControlEntry:
+    """Control data of the tenant from the cache. Stale entries are revalidated with the
+    version of _CONTROL and reloaded only if the version changed. The DB calls run in the
+    executor of the pool, so that the event loop is not blocked"""
+    entry, stale = glob.control_cache.get(schema_name)
+    if entry and not stale:
+        return entry
+    try:
+        if entry:
+            rows = await retry_read_async(lambda validate: read_control(schema_name, validate, False))
+            if control_version(rows) == entry.version:
+                glob.control_cache.validated(entry)
+                return entry
+        res = await retry_read_async(lambda validate: read_control(schema_name, validate))
+    except HDBException as e:
+        glob.control_cache.pop(schema_name)
+        if e.errorcode == 362:
+            handle_error(
+                f"Tennant id '{tenant_id}' does not exist", 404)
+        else:
+            handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
+    mapping = None
+    loader = None
+    id_generator = None
+    size = 0
     for r in res:
         match r[0]:
             case 'MAPPING':
-                glob.mapping[schema_name] = json.loads(r[1])
+                mapping = parse_mapping(r[2])
+                size = len(r[2])
+            case 'MAPPING_INDEX':
+                loader = PartLoader(json.loads(r[2]), lambda part_numbers: retry_read_async(\
+                    lambda validate: read_control_parts(schema_name, part_numbers, validate)))
+                mapping = lazy_mapping(loader)
+                size = len(r[2])
             case 'TENANT_CONFIG':
-                tenant_config = json.loads(r[1])
+                tenant_config = json.loads(r[2])
                 id_generator = getattr(convert, tenant_config['idGenerator'])()
-                glob.id_generator[schema_name] = id_generator
+    entry = ControlEntry(control_version(res), mapping, id_generator, size)
+    if loader:
+        loader.on_load = partial(glob.control_cache.grow, entry)
+    glob.control_cache.put(schema_name, entry)
+    return entry
+
+
+async def prefetch_control(num_tenants):
+    """Loads the control data of the num_tenants most recently created tenants into the cache"""
+    try:
+        async with AsyncDBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
+            sql = f'select top {int(num_tenants)} schema_name from sys.schemas \
+                where schema_name like \'{glob.db_tenant_prefix}%\' order by CREATE_TIME desc'
+            await db.cur.execute(sql)
+            schema_names = [w[0] for w in await db.cur.fetchall()]
+    except HDBException as e:
+        logging.warning('Prefetch of tenants failed: %s', e.errortext)
+        return
+    for schema_name in schema_names:
+        try:
+            await get_control(schema_name[len(glob.db_tenant_prefix):], schema_name)
+        except HTTPException as e:
+            logging.warning('Prefetch of %s failed: %s', schema_name, e.detail)
+
+
+def clear_derived_buffers(schema_name):
+    glob.assembly_plans.pop(schema_name, None)
+    glob.statements.pop(schema_name, None)
+    glob.mapping_models.pop(schema_name, None)
+    glob.view_libraries.pop(schema_name, None)
+    # the views may not match the reloaded mapping, they are dropped with the next search
+    glob.view_cache.retire(schema_name)
+    # the model may have been deployed by another worker
+    glob.metadata_cache.invalidate(schema_name)
 
 
 def clear_control_buffer(schema_name):
-    glob.mapping.pop(schema_name, None)
-    glob.id_generator.pop(schema_name, None)
+    glob.control_cache.pop(schema_name)
+    glob.search_cache.invalidate(schema_name)
+    glob.metadata_cache.invalidate(schema_name)
+
+
+async def get_IdGenerator(tenant_id, schema_name):
+    return (await get_control(tenant_id, schema_name)).id_generator
 
 
-def get_mapping(tenant_id, schema_name):
-    if not schema_name in glob.mapping:
-        refresh_control_buffer(tenant_id, schema_name)
-    return glob.mapping[schema_name]
+async def get_mapping(tenant_id, schema_name):
+    return (await get_control(tenant_id, schema_name)).mapping
 
 
 def handle_error(msg: str = '', status_code: int = -1):
@@ -94,6 +187,18 @@ def handle_error(msg: str = '', status_code: int = -1):
         raise HTTPException(status_code, msg)
 
 
+def json_default(value):
+    """Types not serialized by orjson, encoded like fastapi's jsonable_encoder"""
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError
+
+
+def json_response(content):
+    """Serializes content directly with orjson, bypassing fastapi's generic encoding"""
+    return Response(content=orjson.dumps(content, default=json_default), media_type='application/json')
+
+
 def validate_tenant_id(tenant_id: str):
     if not tenant_id.isalnum():
         handle_error('Tenant-ID must be alphanumeric', 400)
@@ -117,23 +222,23 @@ async def post_tenant(tenant_id, tenant_config = Body(None)):
         id_generator = convert.IdGenerator.UUID1.value
     t_config = {'idGenerator':id_generator}
     tenant_schema_name = get_tenant_schema_name(tenant_id)
-    with DBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
         try:
             sql = f'create schema "{tenant_schema_name}"'
-            db.cur.execute(sql)
+            await db.cur.execute(sql)
         except HDBException as e:
-            db.cur.connection.rollback()
+            await db.rollback()
             if e.errorcode == 386:
                 handle_error(
                     f"Tenant creation failed. Tennant id '{tenant_id}' already exists", 422)
             else:
                 handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
         try:
-            db.cur.execute(
+            await db.cur.execute(
                 f'create table "{tenant_schema_name}"."_CONTROL" (TYPE NVARCHAR(80) PRIMARY KEY, CREATED_AT TIMESTAMP, CONTENT NCLOB)')
-            glob.mapping.pop(tenant_schema_name, None)
+            clear_control_buffer(tenant_schema_name)
         except HDBException as e:
-            db.cur.connection.rollback()
+            await db.rollback()
             handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
         try:
             read_user_name = get_user_name(
@@ -142,66 +247,79 @@ async def post_tenant(tenant_id, tenant_config = Body(None)):
                 glob.db_schema_prefix, DBUserType.DATA_WRITE)
             schema_modify_user_name = get_user_name(
                 glob.db_schema_prefix, DBUserType.SCHEMA_MODIFY)
-            db.cur.execute(
-                f'GRANT SELECT ON SCHEMA "{tenant_schema_name}" TO {read_user_name}')
-            db.cur.execute(
-                f'GRANT SELECT ON "{tenant_schema_name}"."_CONTROL" TO {read_user_name}')
-            db.cur.execute(
-                f'GRANT INSERT ON SCHEMA "{tenant_schema_name}" TO {write_user_name}')
-            db.cur.execute(
-                f'GRANT SELECT ON SCHEMA "{tenant_schema_name}" TO {write_user_name}')
-            db.cur.execute(
-                f'GRANT DELETE ON SCHEMA "{tenant_schema_name}" TO {write_user_name}')
-            db.cur.execute(
-                f'GRANT SELECT ON "{tenant_schema_name}"."_CONTROL" TO {schema_modify_user_name}')
-            db.cur.execute(
-                f'GRANT INSERT ON "{tenant_schema_name}"."_CONTROL" TO {schema_modify_user_name}')
-            db.cur.execute(
-                f'GRANT DELETE ON "{tenant_schema_name}"."_CONTROL" TO {schema_modify_user_name}')
-            db.cur.execute(
-                f'GRANT CREATE ANY ON SCHEMA "{tenant_schema_name}" TO {schema_modify_user_name}')
-            db.cur.execute(
-                f'GRANT DROP ON SCHEMA "{tenant_schema_name}" TO {schema_modify_user_name}')
-            db.cur.execute(
-                f'GRANT ALTER ON SCHEMA "{tenant_schema_name}" TO {schema_modify_user_name}')
+            grants = [
+                f'GRANT SELECT ON SCHEMA "{tenant_schema_name}" TO {read_user_name}',
+                f'GRANT SELECT ON "{tenant_schema_name}"."_CONTROL" TO {read_user_name}',
+                f'GRANT INSERT ON SCHEMA "{tenant_schema_name}" TO {write_user_name}',
+                f'GRANT SELECT ON SCHEMA "{tenant_schema_name}" TO {write_user_name}',
+                f'GRANT DELETE ON SCHEMA "{tenant_schema_name}" TO {write_user_name}',
+                f'GRANT UPDATE ON SCHEMA "{tenant_schema_name}" TO {write_user_name}',
+                f'GRANT SELECT ON "{tenant_schema_name}"."_CONTROL" TO {schema_modify_user_name}',
+                f'GRANT INSERT ON "{tenant_schema_name}"."_CONTROL" TO {schema_modify_user_name}',
+                f'GRANT DELETE ON "{tenant_schema_name}"."_CONTROL" TO {schema_modify_user_name}',
+                f'GRANT CREATE ANY ON SCHEMA "{tenant_schema_name}" TO {schema_modify_user_name}',
+                f'GRANT DROP ON SCHEMA "{tenant_schema_name}" TO {schema_modify_user_name}',
+                f'GRANT ALTER ON SCHEMA "{tenant_schema_name}" TO {schema_modify_user_name}']
+            for grant in grants:
+                await db.cur.execute(grant)
             logging.info('Tenant schema created %s', tenant_schema_name)
         except HDBException as e:
-            db.cur.connection.rollback()
+            await db.rollback()
             handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
-        db.cur.connection.commit()
-        with DBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
+        await db.commit()
+        async with AsyncDBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
             sql = f'insert into "{tenant_schema_name}"._CONTROL (TYPE, CREATED_AT, CONTENT) VALUES (?, ?, ?)'
             values = [('TENANT_CONFIG', datetime.now(), json.dumps(t_config))]
-            db.cur.executemany(sql, values)
-            db.cur.connection.commit()
+            await db.cur.executemany(sql, values)
+            await db.commit()
 
     return {'detail': f"Tenant successfully created"}
 
 @app.delete('/v1/tenant/{tenant_id}')
 async def delete_tenant(tenant_id: str):
     """Delete tenant"""
-    with DBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
         tenant_schema_name = get_tenant_schema_name(tenant_id)
         try:
             clear_control_buffer(tenant_schema_name)
-            db.cur.execute(f'drop schema "{tenant_schema_name}" cascade')
+            # the views are dropped with the schema
+            glob.view_cache.forget(tenant_schema_name)
+            await db.cur.execute(f'drop schema "{tenant_schema_name}" cascade')
         except HDBException as e:
-            db.cur.connection.rollback()
+            await db.rollback()
             if e.errorcode == 362:
                 handle_error(
                     f"Tenant deletion failed. Tennant id '{tenant_id}' does not exist", 404)
             else:
                 handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
-        db.cur.connection.commit()
+        await db.commit()
     return {'detail': f"Tenant successfully deleted"}
 
 
 @app.get('/v1/tenant')
-async def get_tenants():
+def get_tenants():
     """Get all tenants"""
     return get_tenants_sync()
 
 
+def new_connection_pool(l_config, user_type: DBUserType, credentials):
+    pool_config = POOL_DEFAULTS | (l_config['db']['pool'] if 'pool' in l_config['db'] else {})
+    user_config = l_config['db']['user'][user_type.value]
+    if 'pool' in user_config:
+        pool_config |= user_config['pool']
+    return ConnectionPool(credentials,
+        min_connections=pool_config['minConnections'],
+        max_connections=pool_config['maxConnections'],
+        acquire_timeout=pool_config['acquireTimeout'],
+        idle_timeout=pool_config['idleTimeout'],
+        executor_workers=pool_config['executorWorkers'],
+        validation_interval=pool_config['validationInterval'],
+        max_lifetime=pool_config['maxLifetime'],
+        health_check_interval=pool_config['healthCheckInterval'],
+        statement_cache_size=pool_config['statementCacheSize'],
+        on_connect=crud.create_session_tables if user_type == DBUserType.DATA_WRITE else None)
+
+
 def get_tenants_sync():
     if DBUserType.ADMIN not in glob.connection_pools:
         with open('src/.config.json', encoding='utf-8') as fr:
@@ -214,7 +332,7 @@ def get_tenants_sync():
                 db_host = config['db']['connection']['host']
                 db_port = config['db']['connection']['port']
                 credentials = Credentials(db_host, db_port, user_name, user_password)
-                glob.connection_pools[user_type] = ConnectionPool(credentials)
+                glob.connection_pools[user_type] = new_connection_pool(config, user_type, credentials)
                 glob.db_schema_prefix = config['deployment']['schemaPrefix']
                 glob.db_tenant_prefix = glob.db_schema_prefix + TENANT_PREFIX
     with DBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
@@ -230,29 +348,29 @@ def get_tenants_sync():
 async def admin_tenant(tenant_id):
     schema_name = get_tenant_schema_name(tenant_id)
     doc_queue = 0
-    with DBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
         retry = 10
         sql = f"select sum(QUEUE_DOCUMENT_COUNT) from sys.M_FULLTEXT_QUEUES where SCHEMA_NAME = '{schema_name}'"
         while retry:
-            db.cur.execute(sql)
-            res = db.cur.fetchone()[0]
+            await db.cur.execute(sql)
+            res = (await db.cur.fetchone())[0]
             if res:
                 doc_queue = int(res)
             else:
                 doc_queue = 0
             if doc_queue:
-                sleep(1)
+                await asyncio.sleep(1)
                 retry -= 1
             else:
                 break
     if doc_queue and not retry:
         raise HTTPException(500, f'Fulltext index queue has still {doc_queue} items to process')
-    mapping = get_mapping(tenant_id, schema_name)
+    mapping = await get_mapping(tenant_id, schema_name)
     if not mapping:
         return
     sqls = [f'merge delta of "{schema_name}"."{w}"' for w in mapping['tables'].keys()]
     block_size = CONCURRENT_CONNECTIONS if len(sqls) > CONCURRENT_CONNECTIONS else len(sqls)
-    with DBBulkProcessing(glob.connection_pools[DBUserType.SCHEMA_MODIFY], block_size) as db_bulk:
+    async with DBBulkProcessing(glob.connection_pools[DBUserType.SCHEMA_MODIFY], block_size) as db_bulk:
         try:
             await db_bulk.execute(sqls)
             await db_bulk.commit()
@@ -263,8 +381,33 @@ async def admin_tenant(tenant_id):
             handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
 
 
+@app.on_event('startup')
+async def start_prefetch_control():
+    """Prefetches the control data on the event loop of the server, which owns the caches"""
+    cache_config = CONTROL_CACHE_DEFAULTS | (config['server']['controlCache']\
+        if 'controlCache' in config['server'] else {})
+    if cache_config['prefetchTenants'] > 0:
+        app.state.prefetch_task = asyncio.create_task(prefetch_control(cache_config['prefetchTenants']))
+
+
+@app.on_event('shutdown')
+async def drop_cached_views():
+    await search.drop_cached_views()
+
+
+@app.get('/v1/metrics')
+def get_metrics():
+    """Connection pool metrics per DB user type, tenant control cache, column view cache,
+    search result cache and $metadata cache metrics"""
+    return {'connectionPools': {k.value: v.metrics() for k, v in glob.connection_pools.items()},
+        'controlCache': glob.control_cache.metrics(),
+        'viewCache': glob.view_cache.metrics(),
+        'searchCache': glob.search_cache.metrics(),
+        'metadataCache': glob.metadata_cache.metrics()}
+
+
 @app.post('/v1/deploy/{tenant_id}')
-async def post_model(tenant_id: str, cson=Body(...), simulate: bool = False):
+async def post_model(tenant_id: str, cson=Body(...), simulate: bool = False, split_mapping: bool = False):
     """ Deploy model """
     errors = consistency_check.check_cson(cson)
     if errors:
@@ -272,16 +415,17 @@ async def post_model(tenant_id: str, cson=Body(...), simulate: bool = False):
     if simulate:
         return {'detail': 'Model is consistent'}
     else:
-        with DBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
+        async with AsyncDBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
             tenant_schema_name = get_tenant_schema_name(tenant_id)
-            sql = f'select count(*) from "{tenant_schema_name}"."_CONTROL" where "TYPE" = \'MAPPING\''
-            db.cur.execute(sql)
-            num_deployments = db.cur.fetchone()[0]
+            sql = f'select count(*) from "{tenant_schema_name}"."_CONTROL" '\
+                f'where "TYPE" in (\'MAPPING\', \'{MAPPING_INDEX}\')'
+            await db.cur.execute(sql)
+            num_deployments = (await db.cur.fetchone())[0]
             if num_deployments != 0:
                 handle_error('Model already deployed', 422)
         created_at = datetime.now()
         try:
-            id_generator = get_IdGenerator(tenant_id, tenant_schema_name)
+            id_generator = await get_IdGenerator(tenant_id, tenant_schema_name)
             mapping = convert.cson_to_mapping(cson, id_generator)
             ddl = sqlcreate.mapping_to_ddl(
                 mapping, tenant_schema_name, int(glob.esh_apiversion[1]))
@@ -290,7 +434,7 @@ async def post_model(tenant_id: str, cson=Body(...), simulate: bool = False):
         try:
             block_size = CONCURRENT_CONNECTIONS if len(
                 ddl['tables']) > CONCURRENT_CONNECTIONS else len(ddl['tables'])
-            with DBBulkProcessing(glob.connection_pools[DBUserType.SCHEMA_MODIFY], block_size) as db_bulk:
+            async with DBBulkProcessing(glob.connection_pools[DBUserType.SCHEMA_MODIFY], block_size) as db_bulk:
                 try:
                     await db_bulk.execute(ddl['tables'])
                     await db_bulk.execute(ddl['indices'] + ddl['views'])
@@ -300,19 +444,29 @@ async def post_model(tenant_id: str, cson=Body(...), simulate: bool = False):
                 except HDBException as e:
                     await db_bulk.rollback()
                     handle_error(f'dbapi Error: {e.errorcode}, {e.errortext}')
-            with DBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
-                db.cur.callproc(
-                    'ESH_CONFIG', (json.dumps(ddl['eshConfig']), None))
-                res = db.cur.fetchone()
-                if res[0]:
-                    handle_error(res[0], 422)
-                sql = f'insert into "{tenant_schema_name}"._CONTROL (TYPE, CREATED_AT, CONTENT) VALUES (?, ?, ?)'
-                values = [('CSON', created_at, json.dumps(cson)), ('MAPPING', created_at, json.dumps(mapping))]
-                db.cur.executemany(sql, values)
-                db.cur.connection.commit()
-                glob.mapping[tenant_schema_name] = mapping
+            async with AsyncDBConnection(glob.connection_pools[DBUserType.SCHEMA_MODIFY]) as db:
+                try:
+                    await db.cur.callproc(
+                        'ESH_CONFIG', (json.dumps(ddl['eshConfig']), None))
+                    res = await db.cur.fetchone()
+                    if res[0]:
+                        handle_error(res[0], 422)
+                    sql = f'insert into "{tenant_schema_name}"._CONTROL (TYPE, CREATED_AT, CONTENT) VALUES (?, ?, ?)'
+                    values = [('CSON', created_at, json.dumps(cson))]
+                    if split_mapping:
+                        index, parts = mapping_store.split_mapping(mapping)
+                        values.append((MAPPING_INDEX, created_at, json.dumps(index)))
+                        values.extend([(f'{MAPPING_PART_PREFIX}{i}', created_at, json.dumps(w))\
+                            for i, w in enumerate(parts)])
+                    else:
+                        values.append(('MAPPING', created_at, json.dumps(mapping)))
+                    await db.cur.executemany(sql, values)
+                    await db.commit()
+                    clear_control_buffer(tenant_schema_name)
+                except HDBException:
+                    await db.rollback()
+                    raise
         except HDBException as e:
-            db.cur.connection.rollback()
             if e.errorcode == 362:
                 handle_error(f"Tennant id '{tenant_id}' does not exist", 404)
             else:
@@ -325,14 +479,19 @@ def check_objects(objects):
     if not isinstance(objects, dict):
         handle_error('provide dictionary of object types', 400)
 
-def get_ctx(tenant_id):
+async def get_ctx(tenant_id, entity_names=None):
+    """Control data of the tenant. The parts of a split mapping needed for entity_names
+    (all if None) are loaded in advance"""
     ctx = {}
     ctx['tenant_id'] = tenant_id
     ctx['schema_name'] = get_tenant_schema_name(tenant_id)
-    ctx['mapping'] = get_mapping(tenant_id, ctx['schema_name'])
-    ctx['id_generator'] = get_IdGenerator(tenant_id, ctx['schema_name'])
+    control = await get_control(tenant_id, ctx['schema_name'])
+    ctx['mapping'] = control.mapping
+    ctx['id_generator'] = control.id_generator
+    ctx['control_version'] = control.version
     if not ctx['mapping']:
         handle_error('Error: Deploy data model first', 400)
+    await mapping_store.preload(ctx['mapping'], entity_names)
     return ctx
 
 @app.post('/v1/data/{tenant_id}')
@@ -340,36 +499,162 @@ async def post_data(tenant_id, objects=Body(...)):
     """CREATE Data"""
     check_objects(objects)
     try:
-        return await crud.CRUD(get_ctx(tenant_id))\
+        return await crud.CRUD(await get_ctx(tenant_id, objects.keys()))\
             .write_data(objects, convert.WriteMode.CREATE)
     except crud.CrudException as e:
         handle_error(str(e), 400)
-    except HDBException:
+    except HDBException as e:
         handle_error(str(e), 500)
 
 
+def add_ndjson_line(batch, line, line_number):
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise crud.CrudException(f'line {line_number}: invalid JSON: {e}') from e
+    if not isinstance(item, dict):
+        raise crud.CrudException(f'line {line_number}: object type expected')
+    for object_type, obj in item.items():
+        if not isinstance(obj, dict):
+            raise crud.CrudException(f'line {line_number}: one object per line expected for {object_type}')
+        if not object_type in batch:
+            batch[object_type] = []
+        batch[object_type].append(obj)
+    return len(item)
+
+
+async def ndjson_batches(req: Request, batch_size: int):
+    """Parses the request body incrementally. Each line contains one object {object type: object},
+    lists are rejected so that a single line cannot hold the objects of many batches.
+    Yields dicts of object lists per object type with batch_size objects"""
+    batch = {}
+    num_objects = 0
+    line_number = 0
+    rest = b''
+    async for chunk in req.stream():
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                num_objects += add_ndjson_line(batch, line, line_number)
+            if num_objects >= batch_size:
+                yield batch
+                batch = {}
+                num_objects = 0
+    if rest.strip():
+        add_ndjson_line(batch, rest, line_number + 1)
+    if batch:
+        yield batch
+
+
+@app.post('/v1/ingest/{tenant_id}')
+async def ingest_data(tenant_id, req: Request, batch_size: int = INGEST_BATCH_SIZE, commit_every: int = 1):
+    """CREATE Data from NDJSON stream"""
+    if batch_size < 1 or commit_every < 1:
+        handle_error('batch_size and commit_every must be positive', 400)
+    # the parts of the mapping are loaded per batch for its object types
+    ctx = await get_ctx(tenant_id, ())
+    results = await crud.CRUD(ctx).write_data_stream(ndjson_batches(req, batch_size), commit_every)
+    if results and 'error' in results[-1]:
+        handle_error({'batches': results}, 400)
+    return {'batches': results}
+
+
+def ndjson_error(e):
+    msg = f'Data Error: {e.errortext}' if isinstance(e, HDBException) else str(e)
+    return orjson.dumps({'error': msg}) + b'\n'
+
+
+async def ndjson_objects(items):
+    """NDJSON lines {object type: object}. Errors after the response has started
+    are reported as last line {"error": message}"""
+    try:
+        async for object_type, obj in items:
+            yield orjson.dumps({object_type: obj}, default=json_default) + b'\n'
+    except (crud.CrudException, HDBException) as e:
+        yield ndjson_error(e)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(orjson.dumps({'after': key})).decode('utf-8')
+
+
+def decode_cursor(cursor: str):
+    try:
+        return orjson.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))['after']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        handle_error('invalid cursor', 400)
+
+
+async def ndjson_pages(object_type, pages):
+    """NDJSON lines {object type: object}, after every page a line {"cursor": token}
+    to resume the export after this page"""
+    try:
+        async for objects, last_key in pages:
+            for obj in objects:
+                yield orjson.dumps({object_type: obj}, default=json_default) + b'\n'
+            yield orjson.dumps({'cursor': encode_cursor(last_key)}) + b'\n'
+    except (crud.CrudException, HDBException) as e:
+        yield ndjson_error(e)
+
+
 @app.post('/v1/read/{tenant_id}')
-async def read_data(tenant_id: str, objects: dict = Body(...), type_annotation: bool = False):
+async def read_data(tenant_id: str, objects: dict = Body(...), type_annotation: bool = False,\
+    stream: bool = False, chunk_size: int = READ_CHUNK_SIZE):
     """READ Data"""
     check_objects(objects)
+    if chunk_size < 1:
+        handle_error('chunk_size must be positive', 400)
     try:
-        return await crud.CRUD(get_ctx(tenant_id))\
-            .read_data(objects, type_annotation)
+        if stream:
+            items = crud.CRUD(await get_ctx(tenant_id, objects.keys()))\
+                .read_data_stream(objects, type_annotation, chunk_size)
+            return StreamingResponse(ndjson_objects(items), media_type='application/x-ndjson')
+        return json_response(await crud.CRUD(await get_ctx(tenant_id, objects.keys()))\
+            .read_data(objects, type_annotation))
     except crud.CrudException as e:
         handle_error(str(e), 400)
-    except HDBException:
+    except HDBException as e:
         handle_error(str(e), 500)
 
+@app.get('/v1/export/{tenant_id}/{entity}')
+async def export_data(tenant_id, entity, cursor: str = None, page_size: int = READ_CHUNK_SIZE,\
+    type_annotation: bool = False):
+    """EXPORT all objects of an entity as NDJSON"""
+    if page_size < 1:
+        handle_error('page_size must be positive', 400)
+    after = decode_cursor(cursor) if cursor else None
+    try:
+        pages = crud.CRUD(await get_ctx(tenant_id, [entity])).export_data(entity, type_annotation, page_size, after)
+    except crud.CrudException as e:
+        handle_error(str(e), 400)
+    return StreamingResponse(ndjson_pages(entity, pages), media_type='application/x-ndjson')
+
+
 @app.put('/v1/data/{tenant_id}')
 async def put_data(tenant_id, objects=Body(...)):
     """UPDATE Data"""
     check_objects(objects)
     try:
-        return await crud.CRUD(get_ctx(tenant_id))\
+        return await crud.CRUD(await get_ctx(tenant_id, objects.keys()))\
             .update_data(objects)
     except crud.CrudException as e:
         handle_error(str(e), 400)
-    except HDBException:
+    except HDBException as e:
+        handle_error(str(e), 500)
+
+
+@app.patch('/v1/data/{tenant_id}')
+async def patch_data(tenant_id, patches=Body(...)):
+    """UPDATE Data partially (JSON merge patch)"""
+    check_objects(patches)
+    try:
+        return await crud.CRUD(await get_ctx(tenant_id, patches.keys()))\
+            .patch_data(patches)
+    except crud.CrudException as e:
+        handle_error(str(e), 400)
+    except HDBException as e:
         handle_error(str(e), 500)
 
 
@@ -378,11 +663,11 @@ async def delete_data(tenant_id, objects=Body(...)):
     """DELETE Data"""
     check_objects(objects)
     try:
-        return await crud.CRUD(get_ctx(tenant_id))\
+        return await crud.CRUD(await get_ctx(tenant_id, objects.keys()))\
             .delete_data(objects)
     except crud.CrudException as e:
         handle_error(str(e), 400)
-    except HDBException:
+    except HDBException as e:
         handle_error(str(e), 500)
 
 
@@ -403,18 +688,33 @@ async def get_search_by_tenant(tenant_id):
     return RedirectResponse(redirect_url)
 
 
+def metadata_response(entry, req: Request):
+    """Cached $metadata document, not modified if If-None-Match contains its ETag,
+    gzip compressed if accepted by the client. Both encodings have their own ETag"""
+    gzip_encoded = accepts_gzip(req.headers.get('accept-encoding', ''))
+    etag = entry.gzip_etag if gzip_encoded else entry.etag
+    headers = {'Access-Control-Allow-Origin': '*', 'ETag': etag,\
+        'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if 'if-none-match' in req.headers and entry.matches(req.headers['if-none-match'], etag):
+        return Response(status_code=304, headers=headers)
+    if gzip_encoded:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(content=entry.gzip_body, headers=headers, media_type='application/xml')
+    return Response(content=entry.body, headers=headers, media_type='application/xml')
+
+
 @app.get('/v1/search/{tenant_id:path}/{esh_version:path}/$metadata')
-def get_search_metadata(tenant_id, esh_version):
+async def get_search_metadata(tenant_id, esh_version, req: Request):
     schema_name = get_tenant_schema_name(tenant_id)
-    return Response(
-        content=search.perform_search(esh_version, schema_name, '/$metadata', True), headers={"Access-Control-Allow-Origin":"*"}, media_type='application/xml')
+    control = await get_control(tenant_id, schema_name)
+    return metadata_response(await search.get_metadata(esh_version, schema_name, control.version), req)
 
 
 @app.get('/v1/search/{tenant_id:path}/{esh_version:path}/$metadata/{path:path}')
-def get_search_metadata_entity_set(tenant_id, esh_version, path):
+async def get_search_metadata_entity_set(tenant_id, esh_version, path, req: Request):
     schema_name = get_tenant_schema_name(tenant_id)
-    return Response(
-        content=search.perform_search(esh_version, schema_name, '/$metadata/{}' + path, True), headers={"Access-Control-Allow-Origin":"*"}, media_type='application/xml')
+    control = await get_control(tenant_id, schema_name)
+    return metadata_response(await search.get_metadata(esh_version, schema_name, control.version, '/{}' + path), req)
 
 
 @app.get('/v1/search/{tenant_id:path}/{esh_version:path}/$all/{path:path}')
@@ -451,40 +751,43 @@ def post_search(tenant_id, esh_version, body=Body(...)):
         return search.perform_bulk_search(esh_version, schema_name, body)
     except search.SearchException as e:
         handle_error(str(e), 400)
-    except HDBException:
+    except HDBException as e:
         handle_error(str(e), 500)
 
 
 @app.post('/v1/query/{tenant_id}/{esh_version:path}')
 async def query_v1(tenant_id, esh_version, queries: List[EshObject]):
     schema_name = get_tenant_schema_name(tenant_id)
-    mapping = get_mapping(tenant_id, schema_name)
+    mapping = await get_mapping(tenant_id, schema_name)
     try:
-        c = crud.CRUD(get_ctx(tenant_id))
-        return await search.search_query(schema_name, mapping, esh_version, queries, c)
+        ctx = await get_ctx(tenant_id, search.query_scopes(queries))
+        content = await search.search_query(schema_name, mapping, esh_version, queries, crud.CRUD(ctx),\
+            control_version=ctx['control_version'], encode=lambda w: orjson.dumps(w, default=json_default))
+        return Response(content=content, media_type='application/json')
     except search.SearchException as e:
         handle_error(str(e), 400)
-    except HDBException:
+    except HDBException as e:
         handle_error(str(e), 500)
 
 @app.post('/v0.3/ruleset/{tenant_id}')
 async def ruleset_v03(tenant_id, esh_request: EshRequest):
     try:
         schema_name = get_tenant_schema_name(tenant_id)
-        mapping = get_mapping(tenant_id, schema_name)
+        mapping = await get_mapping(tenant_id, schema_name)
+        await mapping_store.preload(mapping, esh_request.query.scope or ())
         mapping_rule_set = map_request_to_rule_set(schema_name, mapping, esh_request)
     except Exception as e:
         handle_error(str(e))
     search_rule_set_query = generate_search_rule_set_query(mapping_rule_set)
     result = []
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
         params = (convert_search_rule_set_query_to_string(
             search_rule_set_query),)
         print(convert_search_rule_set_query_to_string(
             search_rule_set_query))
-        db.cur.callproc('EXECUTE_SEARCH_RULE_SET', params)
+        await db.cur.callproc('EXECUTE_SEARCH_RULE_SET', params)
         # search_results = [json.loads(w[0]) for w in db.cur.fetchall()]
-        rows = db.cur.fetchall()
+        rows = await db.cur.fetchall()
         column_headers = [i[0]
                           for i in db.cur.description]  # get column headers
         # result = [column_headers]  # insert header
@@ -511,18 +814,19 @@ async def ruleset_v03(tenant_id, esh_request: EshRequest):
 async def ruleset_v02(tenant_id, query: EshObject):
     try:
         schema_name = get_tenant_schema_name(tenant_id)
-        mapping = get_mapping(tenant_id, schema_name)
+        mapping = await get_mapping(tenant_id, schema_name)
+        await mapping_store.preload(mapping, query.scope or ())
         mapping_rule_set = map_request_to_rule_set_old(schema_name, mapping, query)
     except Exception as e:
         handle_error(str(e))
     search_rule_set_query = generate_search_rule_set_query(mapping_rule_set)
     result = []
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
         params = (convert_search_rule_set_query_to_string(
             search_rule_set_query),)
-        db.cur.callproc('EXECUTE_SEARCH_RULE_SET', params)
+        await db.cur.callproc('EXECUTE_SEARCH_RULE_SET', params)
         # search_results = [json.loads(w[0]) for w in db.cur.fetchall()]
-        rows = db.cur.fetchall()
+        rows = await db.cur.fetchall()
         column_headers = [i[0]
                           for i in db.cur.description]  # get column headers
         # result = [column_headers]  # insert header
@@ -549,12 +853,12 @@ async def ruleset_v02(tenant_id, query: EshObject):
 async def ruleset_v01(tenant_id, ruleset: SearchRuleSet):
     data = generate_search_rule_set_query(ruleset)
     result = []
-    with DBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
+    async with AsyncDBConnection(glob.connection_pools[DBUserType.DATA_READ]) as db:
         params = (convert_search_rule_set_query_to_string(data),)
         print(params)
-        db.cur.callproc('EXECUTE_SEARCH_RULE_SET', params)
+        await db.cur.callproc('EXECUTE_SEARCH_RULE_SET', params)
         # search_results = [json.loads(w[0]) for w in db.cur.fetchall()]
-        rows = db.cur.fetchall()
+        rows = await db.cur.fetchall()
         column_headers = [i[0]
                           for i in db.cur.description]  # get column headers
         # result = [column_headers]  # insert header
@@ -601,6 +905,25 @@ def reindex_needed(l_versions, l_config):
 def new_version(l_versions, l_config):
     new_v = [k for k, v in l_versions.items() if k > l_config['version']]
     return len(new_v) > 0
+
+
+def migrate_tenants(l_versions, l_config):
+    """Grants privileges added by new versions (tenantGrants) on the schemas of existing tenants"""
+    grants = []
+    for k, v in l_versions.items():
+        if k > l_config['version'] and 'tenantGrants' in v:
+            for user_type_value, privileges in v['tenantGrants'].items():
+                user_name = get_user_name(glob.db_schema_prefix, DBUserType(user_type_value))
+                grants.extend([(w, user_name) for w in privileges])
+    if not grants:
+        return
+    with DBConnection(glob.connection_pools[DBUserType.ADMIN]) as db:
+        for tenant in get_tenants_sync():
+            tenant_schema_name = glob.db_tenant_prefix + tenant['name']
+            for privilege, user_name in grants:
+                db.cur.execute(f'GRANT {privilege} ON SCHEMA "{tenant_schema_name}" TO {user_name}')
+            logging.info('Tenant schema migrated %s', tenant_schema_name)
+        db.con.commit()
 config = {}
 def initialization():
     global config
@@ -626,12 +949,25 @@ def initialization():
     db_port = config['db']['connection']['port']
     glob.db_schema_prefix = config['deployment']['schemaPrefix']
     glob.db_tenant_prefix = glob.db_schema_prefix + TENANT_PREFIX
+    cache_config = CONTROL_CACHE_DEFAULTS | (config['server']['controlCache']\
+        if 'controlCache' in config['server'] else {})
+    glob.control_cache = ControlCache(cache_config['ttl'], cache_config['maxTenants'],\
+        cache_config['maxBytes'], clear_derived_buffers)
+    view_cache_config = VIEW_CACHE_DEFAULTS | (config['server']['viewCache']\
+        if 'viewCache' in config['server'] else {})
+    glob.view_cache = ViewCache(view_cache_config['maxViews'], view_cache_config['ttl'])
+    search_cache_config = SEARCH_CACHE_DEFAULTS | (config['server']['searchCache']\
+        if 'searchCache' in config['server'] else {})
+    glob.search_cache = SearchCache(search_cache_config['maxBytes'], search_cache_config['ttl'])
+    metadata_cache_config = METADATA_CACHE_DEFAULTS | (config['server']['metadataCache']\
+        if 'metadataCache' in config['server'] else {})
+    glob.metadata_cache = SearchCache(metadata_cache_config['maxBytes'], metadata_cache_config['ttl'])
     for user_type_value, user_item in config['db']['user'].items():
         user_type = DBUserType(user_type_value)
         user_name = user_item['name']
         user_password = user_item['password']
         credentials = Credentials(db_host, db_port, user_name, user_password)
-        glob.connection_pools[user_type] = ConnectionPool(credentials)
+        glob.connection_pools[user_type] = new_connection_pool(config, user_type, credentials)
         with DBConnection(glob.connection_pools[user_type]) as db_main:
             db_main.cur.execute('select * from dummy')
 
@@ -646,6 +982,7 @@ def initialization():
                 'Warning: System needs to be setup from scratch again!')
             sys.exit(-1)
         else:
+            migrate_tenants(versions, config)
             config['version'] = [k for k in versions.keys()][-1]
             with open('src/.config.json', 'w', encoding='utf-8') as fr:
                 json.dump(config, fr, indent=4)
@@ -3,5 +3,11 @@ db_schema_prefix = ''
 db_tenant_prefix = ''
 connection_pools = {}
 esh_apiversion = ''
-mapping = {}
-id_generator = {}
\ No newline at end of file
+control_cache = None
+view_cache = None
+assembly_plans = {}
+statements = {}
+view_libraries = {}
+search_cache = None
+metadata_cache = None
+mapping_models = {}
@@ -0,0 +1,117 @@
+"""Compiled SQL statements of a tenant"""
+from constants import IN_LIST_CHUNK_SIZES, TYPES_SPATIAL
+import server_globals as glob
+
+
+_IN_LIST_PLACEHOLDERS = {w: ', '.join(['?'] * w) for w in IN_LIST_CHUNK_SIZES}
+
+
+def chunk_keys(keys):
+    """Splits keys into chunks for IN-lists with bound parameters.
+    Yields (chunk size, parameters) with parameters padded to one of IN_LIST_CHUNK_SIZES"""
+    keys = list(dict.fromkeys(keys))
+    max_size = IN_LIST_CHUNK_SIZES[-1]
+    for start in range(0, len(keys), max_size):
+        chunk = keys[start:start + max_size]
+        for size in IN_LIST_CHUNK_SIZES:
+            if size >= len(chunk):
+                yield size, chunk + [None] * (size - len(chunk))
+                break
+
+
+class Statements():
+    """Schema qualified, parameterized statements per table (and column set) of a tenant
+    mapping. Statements are compiled on first use and kept as long as the mapping is loaded.
+    Templates with placeholder {id_list} are expanded once per IN-list chunk size"""
+
+    def __init__(self, schema_name, mapping):
+        self.schema_name = schema_name
+        self.mapping = mapping
+        self.statements = {}
+        self.in_lists = {}
+
+    def _get(self, key, compile_func):
+        if not key in self.statements:
+            self.statements[key] = compile_func()
+        return self.statements[key]
+
+    def operations(self, sql_template, keys):
+        """Operations (sql, parameters) for a template of this registry"""
+        res = []
+        for size, parameters in chunk_keys(keys):
+            key = (sql_template, size)
+            if key not in self.in_lists:
+                self.in_lists[key] = sql_template.format(id_list=_IN_LIST_PLACEHOLDERS[size])
+            res.append((self.in_lists[key], parameters))
+        return res
+
+    def _table(self, table_name):
+        return f'"{self.schema_name}"."{table_name}"'
+
+    def select(self, table_name):
+        """select of all physical columns of table_name by root ids"""
+        return self._get(('select', table_name), lambda: self.mapping['tables'][table_name]['sql']['select']\
+            .replace('{schema_name}', self.schema_name))
+
+    def delete(self, table_name):
+        """delete of all rows of table_name by root ids"""
+        return self._get(('delete', table_name), lambda: self.mapping['tables'][table_name]['sql']['delete']\
+            .replace('{schema_name}', self.schema_name))
+
+    def select_column(self, table_name, column_names, key_column_name):
+        """select of column_names of table_name by keys of key_column_name"""
+        def compile_func():
+            columns = ', '.join([f'"{w}"' for w in column_names])
+            return f'select {columns} from {self._table(table_name)} where "{key_column_name}" in ({{id_list}})'
+        return self._get(('select_column', table_name, column_names, key_column_name), compile_func)
+
+    def delete_by_pk(self, table_name):
+        """delete of rows of table_name by their primary keys"""
+        pk = self.mapping['tables'][table_name]['pk']
+        return self._get(('delete_by_pk', table_name),\
+            lambda: f'delete from {self._table(table_name)} where "{pk}" in ({{id_list}})')
+
+    def lock(self, table_name):
+        """select for update of rows of table_name by their primary keys"""
+        pk = self.mapping['tables'][table_name]['pk']
+        return self._get(('lock', table_name),\
+            lambda: f'select "{pk}" from {self._table(table_name)} where "{pk}" in ({{id_list}}) for update')
+
+    def select_page(self, table_name, after):
+        """select of the next primary keys of table_name in key order. Parameters are the
+        last key of the previous page (only if after is set) followed by the page size"""
+        def compile_func():
+            pk = self.mapping['tables'][table_name]['pk']
+            where = f' where "{pk}" > ?' if after else ''
+            return f'select "{pk}" from {self._table(table_name)}{where} order by "{pk}" limit ?'
+        return self._get(('select_page', table_name, after), compile_func)
+
+    def placeholder(self, table_name, column_name):
+        column = self.mapping['tables'][table_name]['columns'][column_name]
+        if column['type'] in TYPES_SPATIAL:
+            return f'ST_GeomFromGeoJSON(?, {column["srid"]})'
+        return '?'
+
+    def insert(self, table_name, column_names):
+        """insert into table_name of column_names (tuple)"""
+        def compile_func():
+            columns = ','.join([f'"{k}"' for k in column_names])
+            placeholders = ','.join([self.placeholder(table_name, k) for k in column_names])
+            return f'insert into {self._table(table_name)} ({columns}) values ({placeholders})'
+        return self._get(('insert', table_name, column_names), compile_func)
+
+    def update(self, table_name, column_names):
+        """update of column_names (tuple) of a row of table_name. Parameters are the
+        new values followed by the primary key"""
+        def compile_func():
+            pk = self.mapping['tables'][table_name]['pk']
+            assignments = ', '.join([f'"{w}" = {self.placeholder(table_name, w)}' for w in column_names])
+            return f'update {self._table(table_name)} set {assignments} where "{pk}" = ?'
+        return self._get(('update', table_name, column_names), compile_func)
+
+
+def get_statements(schema_name, mapping) -> Statements:
+    """Statement registry of a tenant, replaced when the mapping is reloaded"""
+    if not schema_name in glob.statements or glob.statements[schema_name].mapping is not mapping:
+        glob.statements[schema_name] = Statements(schema_name, mapping)
+    return glob.statements[schema_name]
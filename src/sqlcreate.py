@@ -1,7 +1,9 @@
 '''Creates SQL commands from tables'''
 from __future__ import annotations
 from copy import deepcopy
-from column_view import ColumnView
+from column_view import ColumnView, association_paths
+from constants import SEARCH_VIEWS_ANNOTATION
+from convert import ModelException, check_path
 
 class Constants(object):
     table_name = 'table_name'
@@ -54,6 +56,55 @@ def tables_dd(tables, schema_name):
     return [f'create table "{schema_name}"."{t[Constants.table_name]}" ( {", ".join(get_columns(t))} )'\
         for t in tables.values()]
 
+def _configured_path_lists(anchor_entity_name, value):
+    if not isinstance(value, list) or not all(isinstance(w, list) and w for w in value):
+        raise ModelException(f'{anchor_entity_name}: annotation {SEARCH_VIEWS_ANNOTATION} must be a list of path lists')
+    return [[w.split('.') if isinstance(w, str) else list(w) for w in path_list] for path_list in value]
+
+def search_views_dd(mapping, anchor_entity_name, schema_name, default_annotations, odata_name, configured):
+    """Column views for cross-entity searches, created together with the default view:
+    one per path list configured with annotation SEARCH_VIEWS_ANNOTATION and one per association
+    of the anchor entity with all properties of the default view of the target entity.
+    The views are registered in the anchor entity (search_views) and used by search queries
+    instead of dynamic views"""
+    anchor_entity = mapping['entities'][anchor_entity_name]
+    candidates = []
+    for path_list in _configured_path_lists(anchor_entity_name, configured):
+        for path in path_list:
+            try:
+                is_valid, _ = check_path(mapping, anchor_entity, path)
+            except (KeyError, IndexError, NotImplementedError):
+                is_valid = False
+            if not is_valid:
+                raise ModelException(f'{anchor_entity_name}: invalid path {".".join(path)} '
+                    f'in annotation {SEARCH_VIEWS_ANNOTATION}')
+        candidates.append((path_list, True))
+    default_cv = ColumnView(mapping, anchor_entity_name, schema_name, default_annotations)
+    for path, target in association_paths(anchor_entity):
+        target_paths = default_cv.default_path_list(mapping['entities'][target])
+        if target_paths:
+            candidates.append(([path + w for w in target_paths], False))
+    views = []
+    search_views = []
+    for path_list, is_configured in candidates:
+        view_name = f'SEARCHVIEW/{odata_name}/{len(search_views)}'
+        view_odata_name = f'SEARCHVIEW_{odata_name}_{len(search_views)}'
+        cv = ColumnView(mapping, anchor_entity_name, schema_name, default_annotations)
+        cv.by_default_and_path_list(path_list, view_name, view_odata_name)
+        try:
+            view, _ = cv.data_definition()
+        except (KeyError, NotImplementedError) as e:
+            if is_configured:
+                raise ModelException(f'{anchor_entity_name}: column view for annotation '
+                    f'{SEARCH_VIEWS_ANNOTATION} not supported') from e
+            # shape not supported by column views, searches fail as with dynamic views
+            continue
+        views.append(view)
+        search_views.append({'view_name': view_name, 'odata_name': view_odata_name, 'path_list': path_list})
+    if search_views:
+        anchor_entity['search_views'] = search_views
+    return views
+
 def mapping_to_ddl(mapping, schema_name, hana_version  = 2):
     tables = tables_dd(mapping['tables'], schema_name)
     indices = get_indices(mapping['tables'], schema_name, hana_version)
@@ -62,13 +113,18 @@ def mapping_to_ddl(mapping, schema_name, hana_version  = 2):
     for anchor_entity_name, anchor_entity in mapping['entities'].items():
         if 'annotations' in anchor_entity and '@EnterpriseSearch.enabled' in anchor_entity['annotations']:
             if anchor_entity['annotations']['@EnterpriseSearch.enabled']:
-                cv = ColumnView(mapping, anchor_entity_name, schema_name, False)
+                default_annotations = False
             else:
                 continue
         else: 
-            cv = ColumnView(mapping, anchor_entity_name, schema_name, True)
+            default_annotations = True
+        configured = anchor_entity['annotations'].pop(SEARCH_VIEWS_ANNOTATION, [])\
+            if 'annotations' in anchor_entity else []
+        cv = ColumnView(mapping, anchor_entity_name, schema_name, default_annotations)
         cv.by_default()
         view, esh_config = cv.data_definition()
         views.append(view)
         esh_configs.append(esh_config)
+        views.extend(search_views_dd(mapping, anchor_entity_name, schema_name, default_annotations\
+            , cv.odata_name, configured))
     return {'tables': tables, 'views': views, 'eshConfig':esh_configs, 'indices':indices}
@@ -0,0 +1,175 @@
+"""Column views used by search queries: views created at deploy time and
+cache of the dynamic column views created for search queries"""
+from asyncio import get_running_loop
+from collections import OrderedDict
+from time import monotonic
+
+
+class CachedView():
+    """A dynamic column view with its search configuration. ready is resolved when
+    the view exists on the DB, in_use counts the requests using it"""
+
+    def __init__(self, cv, ddl, configuration, view_map) -> None:
+        self.cv = cv
+        self.odata_name = cv.odata_name
+        self.ddl = ddl
+        self.configuration = configuration
+        self.view_map = view_map
+        self.ready = get_running_loop().create_future()
+        self.in_use = 0
+        self.last_used = monotonic()
+
+    def column_name_by_path(self, path):
+        return self.cv.column_name_by_path(path)
+
+
+class LibraryView():
+    """A column view created at deploy time. configuration is None for views registered
+    in the search configuration (default views). view_map: view column -> property path"""
+
+    def __init__(self, odata_name, configuration, view_map) -> None:
+        self.odata_name = odata_name
+        self.configuration = configuration
+        self.view_map = view_map
+        self.columns = {tuple(v): k for k, v in view_map.items()}
+
+    def covers(self, pathes):
+        return all(tuple(w) in self.columns for w in pathes)
+
+    def column_name_by_path(self, path):
+        return self.columns[tuple(path)]
+
+
+class ViewLibrary():
+    """Column views of an anchor entity created at deploy time. views_by_key: set of joined
+    association prefixes -> views. Candidates are ordered once by the number of associations,
+    the view found for a path set is kept, so repeated lookups are a dict lookup"""
+    max_resolved = 4096
+
+    def __init__(self, views_by_key) -> None:
+        self.candidates = [(k, w) for k, v in sorted(views_by_key.items(), key=lambda w: len(w[0])) for w in v]
+        self.resolved = {}
+
+    def find(self, pathes, key_func):
+        """View containing all pathes, None if there is none. key_func() returns the set of
+        association prefixes of pathes and is only called if pathes were not looked up before"""
+        path_set = frozenset(pathes)
+        if not path_set in self.resolved:
+            if len(self.resolved) >= self.max_resolved:
+                self.resolved.clear()
+            key = key_func()
+            self.resolved[path_set] = next((w for k, w in self.candidates\
+                if key <= k and w.covers(pathes)), None)
+        return self.resolved[path_set]
+
+
+class ViewCache():
+    """LRU cache of dynamic column views keyed by (schema name, anchor entity, path set).
+    Views which are not in use are evicted when the cache exceeds max_views or when they
+    were idle for more than ttl seconds. Evicted views are collected for dropping.
+    Retired views (of a reloaded mapping) are collected for dropping after their last use.
+    The cache is used from the event loop only"""
+
+    def __init__(self, max_views: int, ttl: float) -> None:
+        self.max_views = max_views
+        self.ttl = ttl
+        self.views = OrderedDict()
+        self.evicted = []
+        self.retired = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, key, factory):
+        """Returns (view, is_new). A new view is created with factory() and
+        must be created on the DB by the caller, which then calls created()"""
+        if key in self.views:
+            self.hits += 1
+            view = self.views[key]
+            self.views.move_to_end(key)
+            is_new = False
+        else:
+            self.misses += 1
+            view = factory()
+            self.views[key] = view
+            is_new = True
+        view.in_use += 1
+        view.last_used = monotonic()
+        self._evict()
+        return view, is_new
+
+    def release(self, view: CachedView):
+        view.in_use -= 1
+        view.last_used = monotonic()
+        if self.retired:
+            self._collect_retired()
+
+    def created(self, view: CachedView, error: Exception = None):
+        """Creation of a new view on the DB finished. Failed views are removed"""
+        if error:
+            for key, v in list(self.views.items()):
+                if v is view:
+                    del self.views[key]
+            view.ready.set_exception(error)
+            # retrieved by waiting requests only, avoid warnings if there are none
+            view.ready.exception()
+        else:
+            view.ready.set_result(True)
+
+    def _evict(self):
+        now = monotonic()
+        for key, view in list(self.views.items()):
+            if view.in_use or not view.ready.done() or view.ready.exception():
+                continue
+            if len(self.views) > self.max_views or now - view.last_used > self.ttl:
+                del self.views[key]
+                self.evicted.append((key[0], view.cv.view_name))
+                self.evictions += 1
+
+    def _collect_retired(self):
+        pending = []
+        for schema_name, view in self.retired:
+            if view.in_use or not view.ready.done():
+                pending.append((schema_name, view))
+            elif not view.ready.exception():
+                self.evicted.append((schema_name, view.cv.view_name))
+        self.retired = pending
+
+    def take_evicted(self):
+        """(schema name, view name) of the evicted views, which must be dropped"""
+        res = self.evicted
+        self.evicted = []
+        return res
+
+    def clear(self):
+        """Removes all views. Returns (schema name, view name) of all views to be dropped"""
+        views = [(k[0], v) for k, v in self.views.items()] + self.retired
+        res = self.take_evicted() + [(k, v.cv.view_name) for k, v in views\
+            if v.ready.done() and not v.ready.exception()]
+        self.views.clear()
+        self.retired = []
+        return res
+
+    def retire(self, schema_name):
+        """Removes the views of a schema (e.g. its mapping was reloaded) and collects them
+        for dropping. Views in use are collected after their last release"""
+        for key in [k for k in self.views if k[0] == schema_name]:
+            self.retired.append((schema_name, self.views.pop(key)))
+        self._collect_retired()
+
+    def forget(self, schema_name):
+        """Removes the views of a schema without dropping them (the schema was dropped)"""
+        for key in [k for k in self.views if k[0] == schema_name]:
+            del self.views[key]
+        self.evicted = [w for w in self.evicted if w[0] != schema_name]
+        self.retired = [w for w in self.retired if w[0] != schema_name]
+
+    def metrics(self):
+        requests = self.hits + self.misses
+        return {
+            'views': len(self.views),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions
+        }
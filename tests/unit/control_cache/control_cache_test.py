@@ -0,0 +1,91 @@
+
+import unittest
+
+from src.control_cache import ControlCache, ControlEntry
+
+
+def new_entry(size=10):
+    return ControlEntry((('MAPPING', '2024-01-01'),), {'entities': {}, 'tables': {}}, None, size)
+
+
+class TestControlCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.evicted = []
+
+
+    def new_cache(self, max_tenants=2, max_bytes=100):
+        return ControlCache(60, max_tenants, max_bytes, self.evicted.append, lambda: self.now)
+
+
+    def test_miss_and_hit(self):
+        cache = self.new_cache()
+        self.assertEqual(cache.get('T1'), (None, False))
+        entry = new_entry()
+        cache.put('T1', entry)
+        self.assertEqual(cache.get('T1'), (entry, False))
+        metrics = cache.metrics()
+        self.assertEqual((metrics['hits'], metrics['misses'], metrics['bytes']), (1, 1, 10))
+
+
+    def test_ttl(self):
+        cache = self.new_cache()
+        entry = new_entry()
+        cache.put('T1', entry)
+        self.now += 61
+        self.assertEqual(cache.get('T1'), (entry, True))
+        cache.validated(entry)
+        self.assertEqual(cache.get('T1'), (entry, False))
+        self.assertEqual(cache.metrics()['revalidations'], 1)
+
+
+    def test_lru_max_tenants(self):
+        cache = self.new_cache()
+        cache.put('T1', new_entry())
+        cache.put('T2', new_entry())
+        cache.get('T1')
+        cache.put('T3', new_entry())
+        self.assertEqual(self.evicted, ['T2'])
+        self.assertEqual(list(cache.entries), ['T1', 'T3'])
+        self.assertEqual(cache.metrics()['evictions'], 1)
+
+
+    def test_max_bytes(self):
+        cache = self.new_cache(max_tenants=10, max_bytes=25)
+        cache.put('T1', new_entry())
+        cache.put('T2', new_entry())
+        cache.put('T3', new_entry())
+        self.assertEqual(self.evicted, ['T1'])
+        self.assertEqual(cache.size, 20)
+        # a single entry larger than max_bytes is kept
+        cache.put('T4', new_entry(50))
+        self.assertEqual(list(cache.entries), ['T4'])
+        self.assertEqual(cache.size, 50)
+
+
+    def test_reload_and_pop(self):
+        cache = self.new_cache()
+        cache.put('T1', new_entry())
+        cache.put('T1', new_entry(20))
+        self.assertEqual(self.evicted, ['T1'])
+        self.assertEqual(cache.size, 20)
+        self.assertEqual(cache.metrics()['reloads'], 1)
+        cache.pop('T1')
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.get('T1'), (None, False))
+
+
+    def test_grow(self):
+        cache = self.new_cache(max_bytes=1000)
+        entry = new_entry()
+        cache.put('T1', entry)
+        cache.grow(entry, 5)
+        self.assertEqual((entry.size, cache.size), (15, 15))
+        cache.pop('T1')
+        cache.grow(entry, 5)
+        self.assertEqual((entry.size, cache.size), (20, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+
+import unittest
+from datetime import date
+from decimal import Decimal
+
+from src.data_diff import ObjectDiff, comparable
+
+
+MAPPING = {
+    'tables': {
+        'PERSON': {
+            'table_name': 'PERSON', 'pk': '_ID', 'level': 0,
+            'columns': {
+                '_ID': {'type': 'NVARCHAR'},
+                'NAME': {'type': 'NVARCHAR'},
+                'AGE': {'type': 'INTEGER'},
+                'BIRTH': {'type': 'DATE'},
+                'ADDRESSES': {'isVirtual': True, 'rel': {'type': 'containment', 'table_name': 'ADDRESS'}}
+            }
+        },
+        'ADDRESS': {
+            'table_name': 'ADDRESS', 'pk': '_ID', 'pkParent': '_ID_PARENT', 'level': 1,
+            'columns': {
+                '_ID': {'type': 'BIGINT'},
+                '_ID_PARENT': {'type': 'NVARCHAR'},
+                'CITY': {'type': 'NVARCHAR'},
+                'PHONES': {'isVirtual': True, 'rel': {'type': 'containment', 'table_name': 'PHONE'}}
+            }
+        },
+        'PHONE': {
+            'table_name': 'PHONE', 'pk': '_ID', 'pkParent': '_ID_PARENT', 'level': 2,
+            'columns': {
+                '_ID': {'type': 'BIGINT'},
+                '_ID_PARENT': {'type': 'BIGINT'},
+                'NUMBER': {'type': 'NVARCHAR'}
+            }
+        }
+    }
+}
+
+
+def rows(persons, addresses, phones):
+    return {'PERSON': persons, 'ADDRESS': addresses, 'PHONE': phones}
+
+
+def compare(old_rows, new_rows):
+    diff = ObjectDiff(MAPPING, 'PERSON')
+    diff.compare(old_rows, new_rows)
+    return diff
+
+
+OLD = rows(
+    [{'_ID': 'P1', 'NAME': 'Anna', 'AGE': 40, 'BIRTH': date(1980, 1, 2)}],
+    [{'_ID': 1, '_ID_PARENT': 'P1', 'CITY': 'Heidelberg'}, {'_ID': 2, '_ID_PARENT': 'P1', 'CITY': 'Mannheim'}],
+    [{'_ID': 10, '_ID_PARENT': 1, 'NUMBER': '123'}, {'_ID': 20, '_ID_PARENT': 2, 'NUMBER': '456'}])
+
+
+class TestComparable(unittest.TestCase):
+
+    def test_normalization(self):
+        self.assertEqual(comparable('DATE', '1980-01-02'), date(1980, 1, 2))
+        self.assertEqual(comparable('DECIMAL', 1.5), comparable('DECIMAL', Decimal('1.5')))
+        self.assertEqual(comparable('INTEGER', '42'), 42)
+        self.assertEqual(comparable('DOUBLE', 1), 1.0)
+        self.assertEqual(comparable('ST_POINT', '{"b": 1, "a": 2}'), comparable('ST_POINT', {'a': 2, 'b': 1}))
+        self.assertIsNone(comparable('NVARCHAR', None))
+
+
+    def test_not_normalizable(self):
+        self.assertEqual(comparable('DATE', 'no date'), 'no date')
+        self.assertEqual(comparable('INTEGER', 'x'), 'x')
+
+
+class TestObjectDiff(unittest.TestCase):
+
+    def test_unchanged(self):
+        new_rows = rows(
+            [{'_ID': 'P1', 'NAME': 'Anna', 'AGE': '40', 'BIRTH': '1980-01-02'}],
+            [{'_ID': 7, '_ID_PARENT': 'P1', 'CITY': 'Mannheim'}, {'_ID': 8, '_ID_PARENT': 'P1', 'CITY': 'Heidelberg'}],
+            [{'_ID': 70, '_ID_PARENT': 7, 'NUMBER': '456'}, {'_ID': 80, '_ID_PARENT': 8, 'NUMBER': '123'}])
+        diff = compare(OLD, new_rows)
+        self.assertEqual(diff.updates, {})
+        self.assertEqual(diff.deletes, {})
+        self.assertEqual(diff.inserts, {})
+
+
+    def test_root_change(self):
+        new_rows = rows(
+            [{'_ID': 'P1', 'NAME': 'Anne', 'AGE': 40, 'BIRTH': date(1980, 1, 2)}], OLD['ADDRESS'], OLD['PHONE'])
+        diff = compare(OLD, new_rows)
+        self.assertEqual(diff.updates, {'PERSON': [(('NAME',), new_rows['PERSON'][0])]})
+        self.assertEqual(diff.deletes, {})
+        self.assertEqual(diff.inserts, {})
+
+
+    def test_subtable_change(self):
+        new_rows = rows(OLD['PERSON'],
+            [{'_ID': 1, '_ID_PARENT': 'P1', 'CITY': 'Heidelberg'}, {'_ID': 3, '_ID_PARENT': 'P1', 'CITY': 'Mannheim'}],
+            [{'_ID': 10, '_ID_PARENT': 1, 'NUMBER': '123'}, {'_ID': 30, '_ID_PARENT': 3, 'NUMBER': '789'}])
+        diff = compare(OLD, new_rows)
+        self.assertEqual(diff.updates, {})
+        self.assertEqual(diff.deletes, {'ADDRESS': [2], 'PHONE': [20]})
+        self.assertEqual(diff.inserts, {'ADDRESS': [new_rows['ADDRESS'][1]], 'PHONE': [new_rows['PHONE'][1]]})
+
+
+    def test_subtable_add_remove(self):
+        new_rows = rows(OLD['PERSON'],
+            [{'_ID': 1, '_ID_PARENT': 'P1', 'CITY': 'Heidelberg'}, {'_ID': 3, '_ID_PARENT': 'P1', 'CITY': 'Berlin'}],
+            [{'_ID': 10, '_ID_PARENT': 1, 'NUMBER': '123'}])
+        diff = compare(OLD, new_rows)
+        self.assertEqual(diff.deletes, {'ADDRESS': [2], 'PHONE': [20]})
+        self.assertEqual(diff.inserts, {'ADDRESS': [new_rows['ADDRESS'][1]]})
+        diff = compare(new_rows, OLD)
+        self.assertEqual(diff.deletes, {'ADDRESS': [3]})
+        self.assertEqual(diff.inserts, {'ADDRESS': [OLD['ADDRESS'][1]], 'PHONE': [OLD['PHONE'][1]]})
+
+
+    def test_new_root(self):
+        new_rows = rows([{'_ID': 'P2', 'NAME': 'Ben', 'AGE': None, 'BIRTH': None}],
+            [{'_ID': 5, '_ID_PARENT': 'P2', 'CITY': 'Berlin'}], [])
+        diff = compare(rows([], [], []), new_rows)
+        self.assertEqual(diff.inserts, {'PERSON': new_rows['PERSON'], 'ADDRESS': new_rows['ADDRESS']})
+        self.assertEqual(diff.deletes, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
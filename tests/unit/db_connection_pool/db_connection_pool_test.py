@@ -0,0 +1,117 @@
+
+import asyncio
+import unittest
+from threading import Thread, current_thread
+from time import sleep
+from unittest import mock
+
+from src import db_connection_pool
+from src.db_connection_pool import ConnectionPool, Credentials, DBBulkProcessing, PoolTimeoutException
+
+
+def new_pool(min_connections=0, max_connections=2):
+    return ConnectionPool(Credentials('host', 30015, 'user', 'password'),
+        min_connections=min_connections, max_connections=max_connections, acquire_timeout=0.05)
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(db_connection_pool.dbapi, 'connect', side_effect=lambda **_: mock.MagicMock())
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def test_bounded(self):
+        pool = new_pool()
+        connections = pool.get_connections(2)
+        with self.assertRaises(PoolTimeoutException):
+            pool.get_connection()
+        metrics = pool.metrics()
+        self.assertEqual(metrics['openConnections'], 2)
+        self.assertEqual(metrics['usedConnections'], 2)
+        self.assertEqual(metrics['timeouts'], 1)
+        pool.return_connections(connections)
+        self.assertEqual(pool.metrics()['usedConnections'], 0)
+        pool.return_connection(pool.get_connection())
+        self.assertEqual(self.connect.call_count, 2)
+
+
+    def test_all_or_nothing(self):
+        pool = new_pool()
+        connection = pool.get_connection()
+        with self.assertRaises(PoolTimeoutException):
+            pool.get_connections(2)
+        self.assertEqual(pool.metrics()['usedConnections'], 1)
+        pool.return_connection(connection)
+        pool.return_connections(pool.get_connections(2))
+        with self.assertRaises(ValueError):
+            pool.get_connections(3)
+
+
+    def test_wait_for_return(self):
+        pool = new_pool(max_connections=1)
+        connection = pool.get_connection()
+        def return_later():
+            sleep(0.05)
+            pool.return_connection(connection)
+        Thread(target=return_later).start()
+        self.assertIs(pool.get_connection(timeout=5), connection)
+        self.assertEqual(pool.metrics()['timeouts'], 0)
+
+
+    def test_on_connect(self):
+        created = []
+        pool = ConnectionPool(Credentials('host', 30015, 'user', 'password'),
+            min_connections=1, max_connections=2, on_connect=created.append)
+        connections = pool.get_connections(2)
+        self.assertEqual(created, connections)
+        pool.return_connections(connections)
+
+
+    def test_return_rolls_back(self):
+        pool = new_pool()
+        connection = pool.get_connection()
+        pool.return_connection(connection)
+        connection.con.rollback.assert_called_once()
+
+
+    def test_bulk_single_connection_offloaded(self):
+        pool = new_pool()
+        threads = []
+        def func(connection):
+            threads.append(current_thread())
+            return connection
+        async def run():
+            async with DBBulkProcessing(pool, 1) as db_bulk:
+                return await db_bulk.run([func, func])
+        res = asyncio.run(run())
+        self.assertEqual(len(res), 2)
+        self.assertTrue(all(w is not current_thread() for w in threads))
+        self.assertEqual(pool.metrics()['usedConnections'], 0)
+
+
+
+    def test_bulk_cancelled_during_checkout(self):
+        pool = ConnectionPool(Credentials('host', 30015, 'user', 'password'),
+            min_connections=0, max_connections=2, acquire_timeout=5)
+        connections = pool.get_connections(2)
+        async def run():
+            async def bulk():
+                async with DBBulkProcessing(pool, 2):
+                    pass
+            task = asyncio.create_task(bulk())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        asyncio.run(run())
+        # the checkout still waiting in the executor gets the connections and returns them
+        pool.return_connections(connections)
+        pool.checkout_executor.shutdown(wait=True)
+        self.assertEqual(pool.metrics()['usedConnections'], 0)
+        pool.return_connections(pool.get_connections(2, timeout=0.05))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+
+import json
+import unittest
+
+from src.db_crud import compile_assembly_plan, merge_patch
+
+
+MAPPING = {
+    'tables': {
+        'PERSON': {
+            'table_name': 'PERSON', 'pk': '_ID', 'level': 0,
+            'columns': {
+                '_ID': {'type': 'NVARCHAR', 'external_path': ['id']},
+                'NAME': {'type': 'NVARCHAR', 'external_path': ['name']},
+                'LOCATION': {'type': 'ST_POINT', 'external_path': ['address', 'location']},
+                'PHOTO': {'type': 'BLOB', 'external_path': ['photo']},
+                'COMPANY': {'type': 'NVARCHAR', 'external_path': ['company'],
+                    'rel': {'type': 'association', 'table_name': 'COMPANY'}},
+                'PHONES': {'isVirtual': True, 'external_path': ['contact', 'phones'],
+                    'rel': {'type': 'containment', 'table_name': 'PHONE'}},
+                'FRIENDS': {'isVirtual': True, 'external_path': ['friends'],
+                    'rel': {'type': 'association', 'table_name': 'PERSON'}}
+            }
+        },
+        'PHONE': {
+            'table_name': 'PHONE', 'pk': '_ID', 'pkParent': '_ID_PARENT', 'level': 1,
+            'columns': {
+                '_ID': {'type': 'BIGINT'},
+                '_ID_PARENT': {'type': 'NVARCHAR'},
+                'NUMBER': {'type': 'NVARCHAR', 'external_path': ['number']}
+            }
+        },
+        'TAG': {
+            'table_name': 'TAG', 'pk': '_ID', 'pkParent': '_ID_PARENT', 'level': 1,
+            'columns': {
+                '_ID_PARENT': {'type': 'NVARCHAR'},
+                '_ID': {'type': 'BIGINT'},
+                '_VALUE': {'type': 'NVARCHAR'}
+            }
+        },
+        'COMPANY': {
+            'table_name': 'COMPANY', 'pk': '_ID', 'level': 0,
+            'columns': {
+                '_ID': {'type': 'NVARCHAR', 'external_path': ['id']}
+            }
+        }
+    }
+}
+
+
+class TestCompileAssemblyPlan(unittest.TestCase):
+
+    def test_root_table(self):
+        plan = compile_assembly_plan(MAPPING, MAPPING['tables']['PERSON'])
+        self.assertEqual(plan['key'], 0)
+        self.assertEqual(plan['pk'], 0)
+        operations = [(i, parent, leaf, table_name) for i, parent, leaf, _, table_name in plan['operations']]
+        self.assertEqual(operations, [
+            (0, (), 'id', None),
+            (1, (), 'name', None),
+            (2, ('address',), 'location', None),
+            (3, (), 'photo', None),
+            (4, ('company',), 'id', None),
+            (None, ('contact',), 'phones', 'PHONE')])
+
+
+    def test_converters(self):
+        converters = {leaf: converter for _, _, leaf, converter, _ in\
+            compile_assembly_plan(MAPPING, MAPPING['tables']['PERSON'])['operations']}
+        self.assertIsNone(converters['name'])
+        self.assertIsNone(converters['phones'])
+        self.assertEqual(converters['location']('{"type": "Point"}'), json.loads('{"type": "Point"}'))
+        self.assertEqual(converters['photo'](b'abc'), 'YWJj\n')
+
+
+    def test_subtable(self):
+        plan = compile_assembly_plan(MAPPING, MAPPING['tables']['PHONE'])
+        self.assertEqual(plan['pk'], 0)
+        self.assertEqual(plan['key'], 1)
+        self.assertEqual([w[:3] for w in plan['operations']], [(2, (), 'number')])
+
+
+    def test_scalar_array(self):
+        plan = compile_assembly_plan(MAPPING, MAPPING['tables']['TAG'])
+        self.assertEqual(plan, {'key': 0, 'value': None})
+
+
+class TestMergePatch(unittest.TestCase):
+
+    def test_replace_and_add(self):
+        target = {'name': 'Anna', 'age': 40}
+        self.assertEqual(merge_patch(target, {'age': 41, 'city': 'Heidelberg'}),
+            {'name': 'Anna', 'age': 41, 'city': 'Heidelberg'})
+        self.assertEqual(target, {'name': 'Anna', 'age': 40})
+
+
+    def test_null_deletes(self):
+        self.assertEqual(merge_patch({'name': 'Anna', 'age': 40}, {'age': None, 'city': None}), {'name': 'Anna'})
+
+
+    def test_nested(self):
+        target = {'address': {'city': 'Heidelberg', 'zip': '69117'}, 'name': 'Anna'}
+        self.assertEqual(merge_patch(target, {'address': {'zip': None, 'street': 'Hauptstr.'}}),
+            {'address': {'city': 'Heidelberg', 'street': 'Hauptstr.'}, 'name': 'Anna'})
+        self.assertEqual(merge_patch({'address': 'unknown'}, {'address': {'city': 'Mannheim'}}),
+            {'address': {'city': 'Mannheim'}})
+        self.assertEqual(merge_patch({}, {'address': {'city': None}}), {'address': {}})
+
+
+    def test_arrays(self):
+        target = {'phones': [{'number': '123'}, {'number': '456'}]}
+        self.assertEqual(merge_patch(target, {'phones': [{'number': '789'}]}), {'phones': [{'number': '789'}]})
+        self.assertEqual(merge_patch(target, {'phones': []}), {'phones': []})
+        self.assertEqual(merge_patch({'tags': ['a']}, {'tags': {'a': 1}}), {'tags': {'a': 1}})
+
+
+    def test_non_object_patch(self):
+        self.assertEqual(merge_patch({'name': 'Anna'}, ['x']), ['x'])
+        self.assertIsNone(merge_patch({'name': 'Anna'}, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
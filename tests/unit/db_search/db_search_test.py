@@ -0,0 +1,51 @@
+
+import asyncio
+import unittest
+from unittest import mock
+
+from src import db_search
+from src.search_cache import SearchCache
+
+
+class TestGetMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = []
+        self.calls = 0
+        async def retry_read_async(func):
+            self.calls += 1
+            return self.rows
+        patcher = mock.patch.object(db_search, 'retry_read_async', retry_read_async)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache = db_search.glob.metadata_cache
+        db_search.glob.metadata_cache = SearchCache(1024 * 1024, 3600)
+        self.addCleanup(setattr, db_search.glob, 'metadata_cache', cache)
+
+
+    def get_metadata(self, control_version):
+        return asyncio.run(db_search.get_metadata('v20411', 'T1', control_version))
+
+
+    def test_cached(self):
+        self.rows = [('<edmx:Edmx/>',)]
+        self.assertEqual(self.get_metadata(1).body, b'<edmx:Edmx/>')
+        self.assertEqual(self.get_metadata(1).body, b'<edmx:Edmx/>')
+        self.assertEqual(self.calls, 1)
+        # the model was deployed by another worker
+        self.rows = [('<edmx:Edmx></edmx:Edmx>',)]
+        self.assertEqual(self.get_metadata(2).body, b'<edmx:Edmx></edmx:Edmx>')
+        self.assertEqual(self.calls, 2)
+
+
+    def test_empty_and_error_not_cached(self):
+        self.assertEqual(self.get_metadata(1).body, b'')
+        self.rows = [('{"error": {"code": 500, "message": "failed"}}',)]
+        self.assertTrue(self.get_metadata(1).body.startswith(b'{"error"'))
+        self.rows = [('<edmx:Edmx/>',)]
+        self.assertEqual(self.get_metadata(1).body, b'<edmx:Edmx/>')
+        self.assertEqual(self.calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+
+import unittest
+
+from src import mapping_model
+from src.mapping_model import MappingModel, get_mapping_model
+
+
+MAPPING = {
+    'tables': {
+        'PERSON': {
+            'table_name': 'PERSON', 'pk': '_ID', 'level': 0,
+            'columns': {
+                '_ID': {'type': 'NVARCHAR', 'external_path': ['id']},
+                'PHOTO': {'type': 'BLOB', 'external_path': ['photo']},
+                'LOCATION': {'type': 'ST_POINT', 'external_path': ['location']},
+                'COMPANY': {'type': 'NVARCHAR', 'external_path': ['company'],
+                    'rel': {'type': 'association', 'table_name': 'COMPANY'}},
+                'PHONES': {'isVirtual': True, 'external_path': ['phones'],
+                    'rel': {'type': 'containment', 'table_name': 'PHONE'}}
+            }
+        },
+        'PHONE': {
+            'table_name': 'PHONE', 'pk': '_ID1', 'pkParent': '_ID', 'level': 1,
+            'columns': {
+                '_ID': {'type': 'NVARCHAR'},
+                '_ID1': {'type': 'NVARCHAR'},
+                'NUMBER': {'type': 'NVARCHAR', 'external_path': ['number']}
+            }
+        }
+    }
+}
+
+
+class TestMappingModel(unittest.TestCase):
+
+    def test_table(self):
+        model = MappingModel(MAPPING)
+        table = model.table('PERSON')
+        self.assertIs(model.table('PERSON'), table)
+        self.assertEqual((table.name, table.pk, table.pk_parent, table.level), ('PERSON', '_ID', None, 0))
+        self.assertEqual(table.physical, ('_ID', 'PHOTO', 'LOCATION', 'COMPANY'))
+        self.assertEqual([w.name for w in table.data], ['PHOTO', 'LOCATION', 'COMPANY'])
+        self.assertEqual(table.children, ('PHONE',))
+        subtable = model.table('PHONE')
+        self.assertEqual((subtable.pk_parent, subtable.physical), ('_ID', ('_ID', '_ID1', 'NUMBER')))
+        self.assertEqual([w.name for w in subtable.data], ['NUMBER'])
+
+
+    def test_flags(self):
+        table = MappingModel(MAPPING).table('PERSON')
+        self.assertTrue(table.column('PHOTO').b64_decode and table.column('PHOTO').b64_encode)
+        self.assertTrue(table.column('LOCATION').is_spatial)
+        company = table.column('COMPANY')
+        self.assertEqual((company.is_association, company.is_virtual, company.rel_table_name), (True, False, 'COMPANY'))
+        phones = table.column('PHONES')
+        self.assertEqual((phones.is_containment, phones.is_virtual, phones.external_path), (True, True, ('phones',)))
+        with self.assertRaises(AttributeError):
+            company.is_virtual = True
+
+
+    def test_ext_to_int(self):
+        table = MappingModel(MAPPING).table('PERSON')
+        self.assertEqual(table.column('PHOTO').ext_to_int('YWJj\n'), b'abc')
+        self.assertEqual(table.column('LOCATION').ext_to_int({'type': 'Point'}), '{"type": "Point"}')
+        self.assertEqual(table.column('_ID').ext_to_int('P1'), 'P1')
+
+
+    def test_get_mapping_model(self):
+        model = get_mapping_model('T1', MAPPING)
+        self.assertIs(get_mapping_model('T1', MAPPING), model)
+        self.assertIsNot(get_mapping_model('T1', dict(MAPPING)), model)
+        mapping_model.glob.mapping_models.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
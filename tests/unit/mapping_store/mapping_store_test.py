@@ -0,0 +1,100 @@
+
+import asyncio
+import json
+import unittest
+
+from src import mapping_store
+from src.mapping_store import PartLoader, PartNotLoadedException, lazy_mapping, split_mapping
+
+
+MAPPING = {
+    'entities': {
+        'Person': {'table_name': 'PERSON'},
+        'Company': {'table_name': 'COMPANY'},
+        'Country': {'table_name': 'COUNTRY'}
+    },
+    'tables': {
+        'PERSON': {'columns': {
+            'NAME': {'type': 'NVARCHAR'},
+            'PHONES': {'isVirtual': True, 'rel': {'type': 'containment', 'table_name': 'PHONE'}},
+            'COMPANY': {'type': 'NVARCHAR', 'rel': {'type': 'association', 'table_name': 'COMPANY'}}
+        }},
+        'PHONE': {'columns': {'NUMBER': {'type': 'NVARCHAR'}}},
+        'COMPANY': {'columns': {
+            'COUNTRY': {'type': 'NVARCHAR', 'rel': {'type': 'association', 'table_name': 'COUNTRY'}}
+        }},
+        'COUNTRY': {'columns': {'NAME': {'type': 'NVARCHAR'}}},
+        'ORPHAN': {'columns': {'NAME': {'type': 'NVARCHAR'}}}
+    }
+}
+
+
+def new_loader():
+    index, parts = split_mapping(MAPPING)
+    contents = [json.dumps(w) for w in parts]
+    loaded = []
+    async def load_parts_async(part_numbers):
+        loaded.extend(part_numbers)
+        return {w: contents[w] for w in part_numbers}
+    # index and parts are stored as JSON in _CONTROL
+    return PartLoader(json.loads(json.dumps(index)), load_parts_async), loaded
+
+
+class TestSplitMapping(unittest.TestCase):
+
+    def test_split(self):
+        index, parts = split_mapping(MAPPING)
+        self.assertEqual(index['entities'], {'Person': 0, 'Company': 1, 'Country': 2})
+        self.assertEqual(index['tables'], {'PERSON': 0, 'PHONE': 0, 'COMPANY': 1, 'COUNTRY': 2, 'ORPHAN': 3})
+        self.assertEqual(parts[0]['tables'].keys(), {'PERSON', 'PHONE'})
+        self.assertEqual(parts[3], {'entities': {}, 'tables': {'ORPHAN': MAPPING['tables']['ORPHAN']}})
+
+
+    def test_round_trip(self):
+        loader, loaded = new_loader()
+        mapping = lazy_mapping(loader)
+        self.assertEqual(list(mapping['entities']), list(MAPPING['entities']))
+        self.assertEqual(len(mapping['tables']), len(MAPPING['tables']))
+        self.assertTrue('ORPHAN' in mapping['tables'])
+        self.assertEqual(loaded, [])
+        asyncio.run(mapping_store.preload(mapping))
+        self.assertEqual({k: dict(v) for k, v in mapping.items()}, MAPPING)
+        self.assertEqual(sorted(loaded), [0, 1, 2, 3])
+
+
+    def test_not_loaded(self):
+        loader, loaded = new_loader()
+        mapping = lazy_mapping(loader)
+        with self.assertRaises(PartNotLoadedException):
+            mapping['tables']['PHONE']
+        with self.assertRaises(KeyError):
+            mapping['tables']['UNKNOWN']
+        self.assertEqual(loaded, [])
+
+
+    def test_on_load(self):
+        sizes = []
+        loader, _ = new_loader()
+        loader.on_load = sizes.append
+        asyncio.run(mapping_store.preload(lazy_mapping(loader), ['Country']))
+        self.assertEqual(sizes, [len(json.dumps(split_mapping(MAPPING)[1][2]))])
+
+
+    def test_preload(self):
+        loader, loaded = new_loader()
+        mapping = lazy_mapping(loader)
+        asyncio.run(mapping_store.preload(mapping, ['Person', 'Unknown']))
+        # the associated company and its country are needed as well
+        self.assertEqual(loaded, [0, 1, 2])
+        self.assertEqual(mapping['tables']['COUNTRY'], MAPPING['tables']['COUNTRY'])
+        asyncio.run(mapping_store.preload(mapping))
+        self.assertEqual(loaded, [0, 1, 2, 3])
+
+
+    def test_preload_not_split(self):
+        asyncio.run(mapping_store.preload(MAPPING, ['Person']))
+        asyncio.run(mapping_store.preload(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
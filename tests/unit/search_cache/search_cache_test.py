@@ -0,0 +1,110 @@
+
+import gzip
+import unittest
+
+from src.search_cache import MetadataEntry, SearchCache, accepts_gzip
+
+
+class TestSearchCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+
+
+    def test_get_put(self):
+        cache = SearchCache(100, 60, lambda: self.now)
+        self.assertIsNone(cache.get(('T1', 'q')))
+        cache.put(('T1', 'q'), 'result', 6, cache.generation('T1'))
+        self.assertEqual(cache.get(('T1', 'q')), 'result')
+        metrics = cache.metrics()
+        self.assertEqual((metrics['hits'], metrics['misses'], metrics['bytes']), (1, 1, 6))
+
+
+    def test_invalidate(self):
+        cache = SearchCache(100, 60, lambda: self.now)
+        cache.put(('T1', 'q'), 'result', 6, cache.generation('T1'))
+        cache.put(('T2', 'q'), 'result', 6, cache.generation('T2'))
+        cache.invalidate('T1')
+        self.assertIsNone(cache.get(('T1', 'q')))
+        self.assertEqual(cache.get(('T2', 'q')), 'result')
+        self.assertEqual(cache.metrics()['bytes'], 6)
+
+
+    def test_write_during_search(self):
+        cache = SearchCache(100, 60, lambda: self.now)
+        generation = cache.generation('T1')
+        cache.invalidate('T1')
+        cache.put(('T1', 'q'), 'result', 6, generation)
+        self.assertIsNone(cache.get(('T1', 'q')))
+        self.assertEqual(cache.metrics()['results'], 0)
+
+
+    def test_ttl(self):
+        cache = SearchCache(100, 60, lambda: self.now)
+        cache.put(('T1', 'q'), 'result', 6, 0)
+        self.now += 61
+        self.assertIsNone(cache.get(('T1', 'q')))
+        self.assertEqual(cache.metrics()['bytes'], 0)
+
+
+    def test_max_bytes(self):
+        cache = SearchCache(10, 60, lambda: self.now)
+        cache.put(('T1', 'a'), 'a', 4, 0)
+        cache.put(('T1', 'b'), 'b', 4, 0)
+        cache.get(('T1', 'a'))
+        cache.put(('T1', 'c'), 'c', 4, 0)
+        self.assertIsNone(cache.get(('T1', 'b')))
+        self.assertEqual(cache.get(('T1', 'a')), 'a')
+        cache.put(('T1', 'd'), 'd', 11, 0)
+        self.assertIsNone(cache.get(('T1', 'd')))
+        self.assertEqual(cache.metrics()['evictions'], 1)
+
+
+class TestMetadataEntry(unittest.TestCase):
+
+    def test_body(self):
+        entry = MetadataEntry(b'<edmx:Edmx/>')
+        self.assertEqual(gzip.decompress(entry.gzip_body), b'<edmx:Edmx/>')
+        self.assertEqual(entry.size, len(entry.body) + len(entry.gzip_body))
+        self.assertTrue(entry.etag.startswith('"') and entry.etag.endswith('"'))
+        self.assertEqual(entry.etag, MetadataEntry(b'<edmx:Edmx/>').etag)
+        self.assertNotEqual(entry.etag, MetadataEntry(b'<edmx:Edmx></edmx:Edmx>').etag)
+
+
+    def test_matches(self):
+        entry = MetadataEntry(b'<edmx:Edmx/>')
+        self.assertTrue(entry.matches(entry.etag, entry.etag))
+        self.assertTrue(entry.matches(f'"other", {entry.etag}', entry.etag))
+        self.assertTrue(entry.matches(f'W/{entry.etag}', entry.etag))
+        self.assertTrue(entry.matches('*', entry.etag))
+        self.assertFalse(entry.matches('"other"', entry.etag))
+        self.assertFalse(entry.matches(entry.etag.strip('"'), entry.etag))
+        self.assertFalse(entry.matches('', entry.etag))
+
+
+    def test_etag_per_encoding(self):
+        entry = MetadataEntry(b'<edmx:Edmx/>')
+        self.assertNotEqual(entry.etag, entry.gzip_etag)
+        self.assertTrue(entry.gzip_etag.startswith('"') and entry.gzip_etag.endswith('"'))
+        self.assertTrue(entry.matches(entry.gzip_etag, entry.gzip_etag))
+        self.assertFalse(entry.matches(entry.etag, entry.gzip_etag))
+        self.assertFalse(entry.matches(entry.gzip_etag, entry.etag))
+
+
+class TestAcceptsGzip(unittest.TestCase):
+
+    def test_accepts_gzip(self):
+        self.assertTrue(accepts_gzip('gzip'))
+        self.assertTrue(accepts_gzip('deflate, gzip;q=0.5'))
+        self.assertTrue(accepts_gzip('GZIP; Q=1'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip(''))
+        self.assertFalse(accepts_gzip('identity'))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('gzip;q=0.0, deflate'))
+        self.assertFalse(accepts_gzip('*, gzip;q=0'))
+        self.assertFalse(accepts_gzip('*;q=0'))
+        self.assertFalse(accepts_gzip('gzip;q=invalid'))
+
+if __name__ == '__main__':
+    unittest.main()
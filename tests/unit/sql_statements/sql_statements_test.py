@@ -0,0 +1,46 @@
+
+import unittest
+
+from src.constants import IN_LIST_CHUNK_SIZES
+from src.sql_statements import chunk_keys
+
+
+class TestChunkKeys(unittest.TestCase):
+
+    def test_padding(self):
+        chunks = list(chunk_keys(['a', 'b', 'c']))
+        self.assertEqual(len(chunks), 1)
+        size, parameters = chunks[0]
+        self.assertIn(size, IN_LIST_CHUNK_SIZES)
+        self.assertEqual(len(parameters), size)
+        self.assertEqual(parameters[:3], ['a', 'b', 'c'])
+        self.assertTrue(all(w is None for w in parameters[3:]))
+
+
+    def test_exact_size(self):
+        size = IN_LIST_CHUNK_SIZES[0]
+        keys = list(range(size))
+        self.assertEqual(list(chunk_keys(keys)), [(size, keys)])
+
+
+    def test_split(self):
+        max_size = IN_LIST_CHUNK_SIZES[-1]
+        keys = list(range(max_size + 1))
+        chunks = list(chunk_keys(keys))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0], (max_size, keys[:max_size]))
+        self.assertEqual(chunks[1][0], IN_LIST_CHUNK_SIZES[0])
+        self.assertEqual(chunks[1][1][0], max_size)
+
+
+    def test_duplicates(self):
+        _, parameters = next(chunk_keys(['a', 'b', 'a']))
+        self.assertEqual([w for w in parameters if w is not None], ['a', 'b'])
+
+
+    def test_empty(self):
+        self.assertEqual(list(chunk_keys([])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from src.view_cache import CachedView, LibraryView, ViewCache, ViewLibrary
+
+
+def new_view(view_name):
+    return CachedView(SimpleNamespace(odata_name=view_name, view_name=view_name), None, None, {})
+
+
+class TestViewCache(unittest.TestCase):
+
+    def test_retire_on_reload(self):
+        async def run():
+            cache = ViewCache(10, 60)
+            views = {}
+            for schema_name, view_name in [('T1', 'V1'), ('T1', 'V2'), ('T2', 'V3')]:
+                view, _ = cache.acquire((schema_name, view_name), lambda n=view_name: new_view(n))
+                cache.created(view)
+                views[view_name] = view
+            cache.release(views['V1'])
+            cache.release(views['V3'])
+            # the mapping of T1 is reloaded, V2 is still used by a request
+            cache.retire('T1')
+            self.assertEqual(cache.take_evicted(), [('T1', 'V1')])
+            self.assertEqual(list(cache.views), [('T2', 'V3')])
+            cache.release(views['V2'])
+            self.assertEqual(cache.take_evicted(), [('T1', 'V2')])
+        asyncio.run(run())
+
+
+    def test_forget_on_delete(self):
+        async def run():
+            cache = ViewCache(10, 60)
+            view, _ = cache.acquire(('T1', 'V1'), lambda: new_view('V1'))
+            cache.created(view)
+            cache.retire('T1')
+            # the schema is dropped with its views
+            cache.forget('T1')
+            cache.release(view)
+            self.assertEqual(cache.take_evicted(), [])
+        asyncio.run(run())
+
+
+class TestViewLibrary(unittest.TestCase):
+
+    def test_find(self):
+        default = LibraryView('DEFAULT', None, {'ID': ['id'], 'NAME': ['name']})
+        company = LibraryView('COMPANY', {}, {'ID': ['id'], 'COMPANY_NAME': ['company', 'name']})
+        library = ViewLibrary({frozenset({'company'}): [company], frozenset(): [default]})
+        keys = []
+        def key_func(key):
+            keys.append(key)
+            return key
+        self.assertIs(library.find([('id',), ('name',)], lambda: key_func(frozenset())), default)
+        self.assertIs(library.find([('id',), ('company', 'name')], lambda: key_func(frozenset({'company'}))), company)
+        self.assertIsNone(library.find([('name',), ('company', 'name')], lambda: key_func(frozenset({'company'}))))
+        # lookups of known path sets do not compute the key again
+        self.assertIs(library.find([('name',), ('id',)], lambda: key_func(None)), default)
+        self.assertEqual(len(keys), 3)
+        self.assertIsNone(ViewLibrary({}).find([('id',)], frozenset))
+
+
+if __name__ == '__main__':
+    unittest.main()